@@ -0,0 +1,151 @@
+'''
+Account index over the confirmed transactions in the chain
+
+Balances and per-address transaction history live in the same SQLite database as
+the block store. They are updated as blocks are added and rolled back when the
+chain is replaced, so looking up an address never scans the chain.
+'''
+import json
+
+# The sender address used for mining rewards
+MINING_SENDER = 0
+
+
+def transaction_value(transaction):
+    # Amounts arrive as numbers or as text from the web forms
+    try:
+        return float(transaction['value'])
+    except (KeyError, TypeError, ValueError):
+        return 0.0
+
+
+def transaction_rows(position, blocks):
+    # (block position, tx position, address, balance change, data, investment) for every
+    # address touched by the transactions of blocks stored from position onwards
+    for offset, block in enumerate(blocks):
+        for tx_position, transaction in enumerate(block['transactions']):
+            value = transaction_value(transaction)
+            data = json.dumps(dict(transaction, block_index=block['index']), sort_keys=True)
+            investment = int(transaction.get('url') is not None)
+            sender = transaction['sender_address']
+            recipient = transaction['recipient_address']
+
+            if sender == recipient:
+                yield (position + offset, tx_position, sender, 0.0, data, investment)
+                continue
+            if sender != MINING_SENDER:
+                yield (position + offset, tx_position, sender, -value, data, investment)
+            yield (position + offset, tx_position, recipient, value, data, investment)
+
+
+class AccountIndex(object):
+    def __init__(self, store):
+        self.store = store
+        self.db = store.db
+        self.lock = store.lock
+
+        if store.read_only:
+            # Kept up to date by the process that writes the store
+            return
+
+        with self.lock, self.db:
+            self.db.execute('CREATE TABLE IF NOT EXISTS account_transactions ('
+                            'block_position INTEGER NOT NULL, tx_position INTEGER NOT NULL, '
+                            'address TEXT NOT NULL, delta REAL NOT NULL, data TEXT NOT NULL, '
+                            'investment INTEGER NOT NULL DEFAULT 0)')
+            columns = [row[1] for row in self.db.execute('PRAGMA table_info(account_transactions)')]
+            if 'investment' not in columns:
+                # Indexed before investments had a column of their own
+                self.db.execute('ALTER TABLE account_transactions ADD COLUMN investment INTEGER NOT NULL DEFAULT 0')
+                self.db.execute("UPDATE account_transactions SET investment = 1 "
+                                "WHERE json_extract(data, '$.url') IS NOT NULL")
+            self.db.execute('CREATE INDEX IF NOT EXISTS account_transactions_investment '
+                            'ON account_transactions (investment, block_position, tx_position)')
+            self.db.execute('CREATE INDEX IF NOT EXISTS account_transactions_address '
+                            'ON account_transactions (address, block_position, tx_position)')
+            self.db.execute('CREATE INDEX IF NOT EXISTS account_transactions_block '
+                            'ON account_transactions (block_position)')
+            self.db.execute('CREATE TABLE IF NOT EXISTS balances (address TEXT PRIMARY KEY, balance REAL NOT NULL)')
+            self.db.execute('CREATE TABLE IF NOT EXISTS account_index (height INTEGER NOT NULL)')
+            if self.db.execute('SELECT COUNT(*) FROM account_index').fetchone()[0] == 0:
+                self.db.execute('INSERT INTO account_index (height) VALUES (0)')
+
+        # Catch up with the block store if we stopped between writing a block and indexing it
+        self.sync()
+
+    @property
+    def height(self):
+        with self.lock:
+            return self.db.execute('SELECT height FROM account_index').fetchone()[0]
+
+    def sync(self):
+        # Index every block in the store that is not indexed yet
+        height = self.height
+        if height > len(self.store):
+            self.rollback(len(self.store))
+        elif height < len(self.store):
+            self.add_blocks(height, list(self.store.iter(height)))
+
+    def add_blocks(self, position, blocks):
+        """
+        Index blocks that were stored from position onwards,
+        anything indexed at or after position is rolled back first
+        """
+        with self.store.transaction():
+            self.remove(position)
+            self.db.executemany('INSERT INTO account_transactions '
+                                '(block_position, tx_position, address, delta, data, investment) '
+                                'VALUES (?, ?, ?, ?, ?, ?)',
+                                transaction_rows(position, blocks))
+            self.apply(position)
+            self.db.execute('UPDATE account_index SET height = ?', (position + len(blocks),))
+
+    def rollback(self, position):
+        # Forget every transaction from blocks at or after position
+        with self.store.transaction():
+            self.remove(position)
+
+    def remove(self, position):
+        self.apply(position, sign=-1)
+        self.db.execute('DELETE FROM account_transactions WHERE block_position >= ?', (position,))
+        self.db.execute('UPDATE account_index SET height = MIN(height, ?)', (position,))
+
+    def apply(self, position, sign=1):
+        # Add (or with sign=-1 take away) the balance changes of blocks at or after position
+        self.db.execute(
+            'INSERT INTO balances (address, balance) '
+            'SELECT address, ? * SUM(delta) FROM account_transactions WHERE block_position >= ? '
+            'GROUP BY address ORDER BY address '
+            'ON CONFLICT (address) DO UPDATE SET balance = balance + excluded.balance',
+            (sign, position))
+
+    def balance(self, address):
+        with self.lock:
+            row = self.db.execute('SELECT balance FROM balances WHERE address = ?', (address,)).fetchone()
+        return row[0] if row else 0.0
+
+    def balances(self, height):
+        # Every address's balance after the first height blocks
+        with self.lock:
+            rows = self.db.execute(
+                'SELECT address, SUM(delta) FROM account_transactions WHERE block_position < ? '
+                'GROUP BY address', (height,)).fetchall()
+        return dict(rows)
+
+    def transactions(self, address, start=0, limit=-1):
+        # Confirmed transactions sent or received by address, oldest first
+        with self.lock:
+            rows = self.db.execute(
+                'SELECT data FROM account_transactions WHERE address = ? '
+                'ORDER BY block_position, tx_position LIMIT ? OFFSET ?',
+                (address, limit, start)).fetchall()
+        return [json.loads(row[0]) for row in rows]
+
+    def investments(self, start=0, limit=-1):
+        # Confirmed transactions with a url, oldest first
+        with self.lock:
+            rows = self.db.execute(
+                'SELECT data FROM account_transactions WHERE investment = 1 '
+                'GROUP BY block_position, tx_position ORDER BY block_position, tx_position LIMIT ? OFFSET ?',
+                (limit, start)).fetchall()
+        return [json.loads(row[0]) for row in rows]
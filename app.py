@@ -6,32 +6,160 @@ References:
 '''
 import hashlib
 import json
-from time import time
+import os
+from time import perf_counter, time
 from uuid import uuid4
 import requests
 
-from flask import Flask, jsonify, request, render_template
+from flask import Flask, Response, g, jsonify, request, render_template
 from urllib.parse import urlparse
 
 
-from blockchain import Blockchain
-from transaction import Transaction, Investment
+from blockchain import Blockchain, BLOCK_INTERVAL, RETARGET_INTERVAL
+from checkpoint import CHECKPOINT_INTERVAL
+from proof import DEFAULT_DIFFICULTY
+from block import Block
+from merkle import merkle_proof
+import wire
+from miner import MiningService
+from gossip import Gossip
+from enrichment import Enricher
+from keystore import KeyPool
+import metrics
+from transaction import Transaction, Investment, load_signer
 
 import binascii
-import Cryptodome
-from Cryptodome.PublicKey import ECC
 from flask_cors import CORS
 
-MINING_SENDER = 0
+# Most blocks a single /chain request returns when a limit is asked for
+MAX_CHAIN_PAGE = 1000
+# Most hashes of a since_hash locator that are looked up
+MAX_LOCATOR = 64
+# Most transactions a single batch request can sign or submit
+MAX_BATCH_SIZE = 10000
+# Seconds to connect to the writer and to wait for its answer, /nodes/resolve can take a while
+FORWARD_TIMEOUT = (2, 120)
+FORWARD_CHUNK_SIZE = 64 * 1024
+
+# standalone runs everything in this process, serve.py runs one writer
+# and many readers that answer from the writer's store and forward the rest
+ROLE = os.environ.get('NODE_ROLE', 'standalone')
+WRITER_URL = os.environ.get('WRITER_URL')
+# What a reader answers itself, from the shared store or with no state at all
+READER_ENDPOINTS = frozenset(('static', 'index', 'configure', 'make_transaction', 'view_transaction',
+                              'new_wallet', 'generate_investment', 'generate_transaction',
+                              'generate_transactions_batch', 'full_chain', 'headers', 'get_block',
+                              'transaction_proof', 'chain_head', 'balance', 'address_transactions',
+                              'investments', 'get_nodes'))
 
 
 ### Setting up our Blockchain as an API with Flask ###
 
 # Instantiate our Flask Node
 app = Flask(__name__)
-
-# Instantiate our blockchain
-blockchain = Blockchain()
+app.json = wire.JSONProvider(app)
+
+# Instantiate our blockchain, kept on disk so restarts don't lose it
+# The difficulty settings can be tuned per deployment, but every node in it has to agree
+blockchain = Blockchain(path=os.environ.get('BLOCKCHAIN_DB', 'blockchain.db'),
+                        difficulty=int(os.environ.get('DIFFICULTY', DEFAULT_DIFFICULTY)),
+                        block_interval=float(os.environ.get('BLOCK_INTERVAL', BLOCK_INTERVAL)),
+                        retarget_interval=int(os.environ.get('RETARGET_INTERVAL', RETARGET_INTERVAL)),
+                        # Comma separated public keys of the nodes whose checkpoints we fast sync from
+                        checkpoint_interval=int(os.environ.get('CHECKPOINT_INTERVAL', CHECKPOINT_INTERVAL)),
+                        trusted_checkpoint_keys=[key for key in os.environ.get('TRUSTED_CHECKPOINT_KEYS', '').split(',')
+                                                 if key],
+                        read_only=ROLE == 'reader',
+                        # Where our node's key is kept, next to the store by default
+                        key_path=os.environ.get('NODE_KEY_FILE'))
+
+# Blocks are mined in the background, rewarding this node
+mining_service = MiningService(blockchain)
+
+# New blocks and transactions are announced to our neighbours, NODE_ADDRESS (host:port) is how
+# they reach us, without it we still take their announcements but make none of our own
+gossip = Gossip(blockchain, address=os.environ.get('NODE_ADDRESS'), on_chain_change=mining_service.restart)
+if gossip.address is None and ROLE != 'reader':
+    blockchain.logger.warning('NODE_ADDRESS is not set, new blocks and transactions will not be announced')
+# Metadata of investment urls for the investments view
+enricher = Enricher()
+# Key pairs for /wallet/new, generated in the background
+wallet_keys = KeyPool()
+
+# Read when /metrics is rendered
+metrics.Gauge('chain_length', 'Blocks in our chain').set_function(lambda: len(blockchain.chain))
+metrics.Gauge('mempool_transactions', 'Transactions waiting to be mined').set_function(lambda: len(blockchain.mempool))
+metrics.Gauge('mempool_bytes', 'Size of the transactions waiting to be mined').set_function(lambda: blockchain.mempool.bytes)
+REQUEST_SECONDS = metrics.Histogram('http_request_seconds', 'Time taken to answer requests',
+                                    labels=('method', 'route', 'status'))
+
+@app.before_request
+def start_timer():
+    g.request_start = perf_counter()
+
+writer = requests.Session() if ROLE == 'reader' else None
+
+@app.before_request
+def forward_to_writer():
+    # Readers answer from the store and hand anything that changes state to the writer
+    if ROLE != 'reader':
+        return None
+    if request.endpoint in READER_ENDPOINTS:
+        blockchain.refresh()
+        return None
+
+    headers = {name: request.headers[name] for name in ('Content-Type', 'Accept') if name in request.headers}
+    try:
+        response = writer.request(request.method, WRITER_URL + request.full_path.rstrip('?'),
+                                  data=request.get_data(), headers=headers, timeout=FORWARD_TIMEOUT, stream=True)
+    except requests.RequestException as e:
+        return 'Writer unavailable: ' + (str(e) or type(e).__name__), 502
+    # Passed on as it arrives, streamed chains stay streamed
+    body = response.iter_content(FORWARD_CHUNK_SIZE)
+    forwarded = Response(body, status=response.status_code, content_type=response.headers.get('Content-Type'))
+    forwarded.call_on_close(response.close)
+    return forwarded
+
+@app.after_request
+def record_latency(response):
+    # Streamed responses are timed up to their first byte
+    if 'request_start' in g:
+        route = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+        REQUEST_SECONDS.observe(perf_counter() - g.request_start, method=request.method,
+                                route=route, status=response.status_code)
+    return response
+
+def respond(response, status):
+    # Answer in JSON, or msgpack when the client asked for it
+    if wire.wants_msgpack(request.accept_mimetypes):
+        return Response(wire.pack(response), mimetype=wire.MSGPACK_MIMETYPE), status
+    return jsonify(response), status
+
+def stream_blocks(fields, key, start=0, stop=None):
+    """
+    Response made of fields plus key -> the blocks in [start, stop), sent a block
+    at a time as they are read from the store, in JSON or msgpack
+    """
+    stop = min(len(blockchain.chain) if stop is None else stop, len(blockchain.chain))
+    if wire.wants_msgpack(request.accept_mimetypes):
+        blocks = (json.loads(block) for block in blockchain.chain.iter_json(start, stop))
+        generate = wire.stream_msgpack(fields, key, blocks, max(stop - start, 0))
+        return Response(generate, mimetype=wire.MSGPACK_MIMETYPE)
+
+    # Stream the stored JSON of each block straight from disk
+    def generate():
+        yield json.dumps(fields)[:-1] + (', ' if fields else '') + f'"{key}": ['
+        for position, block in enumerate(blockchain.chain.iter_json(start, stop)):
+            yield block if position == 0 else ', ' + block
+        yield ']}\n'
+
+    return Response(generate(), mimetype='application/json')
+
+def request_values():
+    # The POSTed body, sent as JSON or as msgpack
+    if wire.msgpack is not None and request.mimetype == wire.MSGPACK_MIMETYPE:
+        return wire.unpack(request.get_data())
+    return request.get_json()
 
 @app.route('/', methods=['GET', 'POST'])
 def index():
@@ -51,39 +179,36 @@ def view_transaction():
 
 @app.route('/wallet/new', methods=['GET'])
 def new_wallet():
-	random_gen = Cryptodome.Random.new().read
-	private_key = ECC.generate(curve='P-256')
-	public_key = private_key.public_key()
+	# Keys generated ahead of time in the background
+	private_key, public_key = wallet_keys.take()
 	response = {
-		'private_key': binascii.hexlify(private_key.export_key(format='DER')).decode('ascii'),
-		'public_key': binascii.hexlify(public_key.export_key(format='DER')).decode('ascii')
+		'private_key': private_key,
+		'public_key': public_key
 	}
 
 	return jsonify(response), 200
 
-@app.route('/mine', methods=['GET'])
+@app.route('/mine', methods=['POST'])
 def mine():
-    # run the proof of work to get the next proof
-    last_block = blockchain.last_block
-    last_proof = last_block['proof']
-    proof = blockchain.proof_of_work(last_proof)
+    # Queue a mining job and return straight away, the proof of work runs in the background
+    job = mining_service.submit()
+    response = {
+        'message': 'Mining job queued',
+        'job': job.to_dict()
+    }
+    return jsonify(response), 202
 
-    # We doll out the reward for mining the block here
-    # And we represent the sender as "0" which refers to the current node as the miner
-    blockchain.submit_transaction(sender_address=MINING_SENDER, recipient_address=blockchain.node_id, value=1, signature="")
+@app.route('/mine/<job_id>', methods=['GET', 'DELETE'])
+def mining_job(job_id):
+    job = mining_service.get(job_id)
+    if job is None:
+        response = {'message': 'Unknown mining job'}
+        return jsonify(response), 404
 
-    # Now create the new block on the blockchain
-    previous_hash= blockchain.hash(last_block)
-    block = blockchain.new_block(proof, previous_hash)
+    if request.method == 'DELETE':
+        mining_service.cancel(job)
 
-    response = {
-        'message': "New Block Added",
-        'index': block['index'],
-        'transactions': block['transactions'],
-        'proof': block['proof'],
-        'previous_hash': block['previous_hash']
-    }
-    return jsonify(response), 200
+    return jsonify(job.to_dict()), 200
 
 @app.route('/generate/investment', methods=['POST'])
 def generate_investment():
@@ -103,7 +228,7 @@ def generate_investment():
 
 @app.route('/investments/new', methods=['POST'])
 def new_investment():
-    values = request.get_json()
+    values = request_values()
     # Check that the required fields are in the POST'ed data
     required = ['sender_address', 'recipient_address', 'amount', 'signature', 'url']
     if not all(k in values for k in required):
@@ -113,10 +238,10 @@ def new_investment():
 
     if transaction_result == False:
         response = {'message': 'Invalid Transaction!'}
-        return jsonify(response), 406
+        return respond(response, 406)
     else:
         response = {'message': 'Investment will be added to Block '+ str(transaction_result)}
-        return jsonify(response), 201
+        return respond(response, 201)
 
 @app.route('/generate/transaction', methods=['POST'])
 def generate_transaction():
@@ -133,9 +258,51 @@ def generate_transaction():
 
     return jsonify(response), 200
 
+def batch_values():
+    # The list of transactions POSTed to a batch endpoint, or an error response
+    values = request_values()
+    if not isinstance(values, dict) or not isinstance(values.get('transactions'), list):
+        return None, ('Missing values', 400)
+    if len(values['transactions']) > MAX_BATCH_SIZE:
+        return None, ('At most %d transactions per batch' % MAX_BATCH_SIZE, 413)
+    return values['transactions'], None
+
+@app.route('/generate/transactions/batch', methods=['POST'])
+def generate_transactions_batch():
+    # Sign a list of transactions and investments, each private key is only imported once
+    transactions, error = batch_values()
+    if error:
+        return error
+
+    required = ['sender_address', 'sender_private_key', 'recipient_address', 'amount']
+    results = []
+    # Imported keys, for this request only
+    signers = {}
+    for values in transactions:
+        if not isinstance(values, dict) or not all(k in values for k in required):
+            results.append({'message': 'Missing values'})
+            continue
+
+        if values.get('url') is not None:
+            transaction = Investment(values['sender_address'], values['sender_private_key'],
+                                     values['recipient_address'], values['amount'], values['url'])
+        else:
+            transaction = Transaction(values['sender_address'], values['sender_private_key'],
+                                      values['recipient_address'], values['amount'])
+        try:
+            signer = signers.get(values['sender_private_key'])
+            if signer is None:
+                signer = signers[values['sender_private_key']] = load_signer(values['sender_private_key'])
+            results.append({'transaction': transaction.to_dict(), 'signature': transaction.sign_transaction(signer)})
+        except (ValueError, TypeError, binascii.Error):
+            results.append({'message': 'Invalid private key'})
+
+    response = {'transactions': results, 'length': len(results)}
+    return respond(response, 200)
+
 @app.route('/transactions/new', methods=['POST'])
 def new_transaction():
-    values = request.get_json()
+    values = request_values()
 
     # Check that the required fields are in the POST'ed data
     required = ['sender_address', 'recipient_address', 'amount', 'signature']
@@ -146,19 +313,248 @@ def new_transaction():
 
     if transaction_result == False:
         response = {'message': 'Invalid Transaction!'}
-        return jsonify(response), 406
+        return respond(response, 406)
     else:
         response = {'message': 'Transaction will be added to Block '+ str(transaction_result)}
-        return jsonify(response), 201
+        return respond(response, 201)
+
+@app.route('/transactions/batch', methods=['POST'])
+def new_transactions_batch():
+    # Submit a list of signed transactions and investments, their signatures are verified together
+    transactions, error = batch_values()
+    if error:
+        return error
+
+    required = ['sender_address', 'recipient_address', 'amount', 'signature']
+    complete = [values for values in transactions
+                if isinstance(values, dict) and all(k in values for k in required)]
+    submitted = iter(blockchain.submit_transactions([
+        {'sender_address': values['sender_address'], 'recipient_address': values['recipient_address'],
+         'value': values['amount'], 'signature': values['signature'], 'url': values.get('url')}
+        for values in complete]))
+
+    results = []
+    for values in transactions:
+        if not isinstance(values, dict) or not all(k in values for k in required):
+            results.append({'accepted': False, 'message': 'Missing values'})
+            continue
+        transaction_result = next(submitted)
+        if transaction_result == False:
+            results.append({'accepted': False, 'message': 'Invalid Transaction!'})
+        else:
+            results.append({'accepted': True, 'block': transaction_result,
+                            'message': 'Transaction will be added to Block ' + str(transaction_result)})
+
+    accepted = sum(result['accepted'] for result in results)
+    response = {'results': results, 'accepted': accepted, 'rejected': len(results) - accepted}
+    return respond(response, 201 if accepted else 406)
+
+def requested_range():
+    """
+    Works out which blocks a /chain or /headers request asks for with
+    - start/limit: a page of blocks by position, negative start counts back from the tip
+    - since_index: the blocks after the block with that index
+    - since_hash: the blocks after the block with that hash, or after the first
+      block on our chain of a comma separated list of hashes (a locator)
+    returns (length, start, stop), start is None if since_hash is unknown
+    """
+    length = len(blockchain.chain)
+    start = request.args.get('start', 0, type=int)
+    # Blocks are numbered from 1 so the block after index n is at position n
+    start = request.args.get('since_index', start, type=int)
+
+    since_hash = request.args.get('since_hash')
+    if since_hash is not None:
+        # A comma separated locator, newest first, means after the first of them on our chain
+        for block_hash in since_hash.split(',')[:MAX_LOCATOR]:
+            position = blockchain.block_position(block_hash)
+            if position is not None:
+                break
+        if position is None:
+            return length, None, None
+        start = position + 1
+
+    if start < 0:
+        start = max(length + start, 0)
+
+    limit = request.args.get('limit', type=int)
+    stop = length if limit is None else start + min(max(limit, 0), MAX_CHAIN_PAGE)
+    return length, start, stop
 
 @app.route('/chain', methods=['GET'])
 def full_chain():
+    # Returns the chain, or the part of it asked for, see requested_range
+    length, start, stop = requested_range()
+    if start is None:
+        response = {'message': 'Unknown block hash'}
+        return respond(response, 404)
+
+    return stream_blocks({'length': length, 'start': start}, 'chain', start, stop), 200
+
+@app.route('/headers', methods=['GET'])
+def headers():
+    # Same as /chain but only the block headers, enough to check the chain of proofs
+    length, start, stop = requested_range()
+    if start is None:
+        response = {'message': 'Unknown block hash'}
+        return respond(response, 404)
+
+    if wire.wants_msgpack(request.accept_mimetypes):
+        count = max(min(stop, length) - start, 0)
+        headers = (Block.header(block) for block in blockchain.chain.iter(start, stop))
+        generate = wire.stream_msgpack({'length': length, 'start': start}, 'headers', headers, count)
+        return Response(generate, mimetype=wire.MSGPACK_MIMETYPE), 200
+
+    def generate():
+        yield f'{{"length": {length}, "start": {start}, "headers": ['
+        for position, block in enumerate(blockchain.chain.iter(start, stop)):
+            header = json.dumps(Block.header(block), sort_keys=True)
+            yield header if position == 0 else ', ' + header
+        yield ']}\n'
+
+    return Response(generate(), mimetype='application/json'), 200
+
+@app.route('/blocks/<block_hash>', methods=['GET'])
+def get_block(block_hash):
+    # A single block with its transactions, for peers that only hold its header
+    position = blockchain.block_position(block_hash)
+    if position is None:
+        response = {'message': 'Unknown block hash'}
+        return respond(response, 404)
+    return respond(blockchain.chain[position], 200)
+
+@app.route('/blocks/<block_hash>/proof/<int:tx_index>', methods=['GET'])
+def transaction_proof(block_hash, tx_index):
+    # Merkle inclusion proof for one transaction of a block
+    position = blockchain.block_position(block_hash)
+    if position is None:
+        response = {'message': 'Unknown block hash'}
+        return jsonify(response), 404
+
+    block = blockchain.chain[position]
+    transactions = block['transactions']
+    if not 0 <= tx_index < len(transactions) or 'merkle_root' not in block:
+        response = {'message': 'No such transaction in this block'}
+        return jsonify(response), 404
+
     response = {
-        'chain': blockchain.chain,
-        'length': len(blockchain.chain)
+        'transaction': transactions[tx_index],
+        'merkle_root': block['merkle_root'],
+        'proof': merkle_proof(transactions, tx_index)
     }
     return jsonify(response), 200
 
+@app.route('/chain/head', methods=['GET'])
+def chain_head():
+    last_block = blockchain.last_block
+    response = {
+        'length': len(blockchain.chain),
+        'index': last_block['index'],
+        'hash': blockchain.hash(last_block),
+        'difficulty': blockchain.next_difficulty(),
+        # Cumulative difficulty of our chain, peers follow the chain with the most
+        'work': blockchain.tree.work()
+    }
+    return respond(response, 200)
+
+@app.route('/balance/<address>', methods=['GET'])
+def balance(address):
+    response = {
+        'address': address,
+        'balance': blockchain.accounts.balance(address)
+    }
+    return jsonify(response), 200
+
+@app.route('/transactions/<address>', methods=['GET'])
+def address_transactions(address):
+    start = request.args.get('start', 0, type=int)
+    limit = min(max(request.args.get('limit', MAX_CHAIN_PAGE, type=int), 0), MAX_CHAIN_PAGE)
+    transactions = blockchain.accounts.transactions(address, start, limit)
+    response = {
+        'address': address,
+        'transactions': transactions,
+        'start': start
+    }
+    return jsonify(response), 200
+
+@app.route('/investments', methods=['GET'])
+def investments():
+    # Confirmed investments with the metadata of their urls, fetched and cached here
+    start = request.args.get('start', 0, type=int)
+    limit = min(max(request.args.get('limit', MAX_CHAIN_PAGE, type=int), 0), MAX_CHAIN_PAGE)
+    response = {
+        'investments': enricher.enrich(blockchain.accounts.investments(start, limit)),
+        'start': start
+    }
+    return jsonify(response), 200
+
+@app.route('/checkpoints/latest', methods=['GET'])
+def latest_checkpoint():
+    # Our signed checkpoint for new nodes to fast sync from
+    checkpoint = blockchain.checkpoint()
+    if checkpoint is None:
+        response = {'message': 'No checkpoint yet'}
+        return respond(response, 404)
+    return respond(checkpoint, 200)
+
+@app.route('/checkpoints/status', methods=['GET'])
+def checkpoint_status():
+    # How far along the background check of the last fast sync is
+    response = {
+        'node_id': blockchain.node_id,
+        'trusted_keys': sorted(blockchain.trusted_checkpoint_keys),
+        'sync': blockchain.checkpoint_status
+    }
+    return jsonify(response), 200
+
+@app.route('/mempool/stats', methods=['GET'])
+def mempool_stats():
+    return jsonify(blockchain.mempool.stats()), 200
+
+@app.route('/mempool/<tx_hash>', methods=['GET'])
+def pending_transaction(tx_hash):
+    # A pending transaction by hash, for peers it was announced to
+    transaction = blockchain.mempool.get(tx_hash)
+    if transaction is None:
+        response = {'message': 'Unknown transaction hash'}
+        return respond(response, 404)
+    return respond(transaction, 200)
+
+def announcement():
+    # The hash and origin of a gossip announcement, or an error response unless one of our neighbours sent it
+    values = request_values()
+    if not isinstance(values, dict) or not values.get('hash') or not values.get('origin'):
+        return None, ('Missing values', 400)
+    if not gossip.accepts(values['hash'], values['origin']):
+        return None, respond({'message': 'Not a block or transaction hash from a registered node'}, 403)
+    return values, None
+
+@app.route('/gossip/block', methods=['POST'])
+def gossip_block():
+    values, error = announcement()
+    if error:
+        return error
+    if gossip.receive_block(values['hash'], values['origin']):
+        return respond({'message': 'Fetching block'}, 202)
+    return respond({'message': 'Block already known'}, 200)
+
+@app.route('/gossip/transaction', methods=['POST'])
+def gossip_transaction():
+    values, error = announcement()
+    if error:
+        return error
+    if gossip.receive_transaction(values['hash'], values['origin']):
+        return respond({'message': 'Fetching transaction'}, 202)
+    return respond({'message': 'Transaction already known'}, 200)
+
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4'), 200
+
+@app.route('/gossip/stats', methods=['GET'])
+def gossip_stats():
+    return jsonify(gossip.stats()), 200
+
 @app.route('/nodes/get', methods=['GET'])
 def get_nodes():
     nodes = list(blockchain.nodes)
@@ -187,18 +583,16 @@ def register_nodes():
 @app.route('/nodes/resolve', methods=['GET'])
 def consensus():
     replaced = blockchain.resolve_conflicts()
-
     if replaced:
-        response = {
-            'message': 'Our chain was updated!',
-            'new_chain': blockchain.chain
-        }
-    else:
-        response = {
-            'message': 'Our chain is authoritative',
-            'chain': blockchain.chain
-        }
-    return jsonify(response), 200
+        # Whatever we were mining on is no longer the tip
+        mining_service.restart()
+
+    # The chain is streamed rather than built up in memory
+    response = {
+        'message': 'Our chain was updated!' if replaced else 'Our chain is authoritative',
+        'unreachable_nodes': blockchain.unreachable_nodes
+    }
+    return stream_blocks(response, 'new_chain' if replaced else 'chain'), 200
 
 if __name__ == '__main__':
-    app.run(host='0.0.0.0', port=5000)
\ No newline at end of file
+    app.run(host=os.environ.get('HOST', '0.0.0.0'), port=int(os.environ.get('PORT', 5000)))
\ No newline at end of file
@@ -0,0 +1,99 @@
+'''
+Consensus round against several local stand-in nodes
+
+Starts small Flask apps that serve /chain/head after a fixed delay, plus /headers and /chain (one of them
+failing and one slower than the round deadline) and times resolve_conflicts.
+With concurrent polling the wall time should be close to the slowest healthy
+peer rather than the sum of every peer's delay. Exits with an AssertionError if
+the chain is not replaced, the round takes as long as polling the peers one
+after another, or the failing and stalled peers are not marked unreachable.
+Run from the repository root: python benchmarks/bench_consensus.py
+'''
+import logging
+import os
+import sys
+import threading
+import time
+
+from flask import Flask, jsonify, request
+from werkzeug.serving import make_server
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import wire
+from block import Block
+from blockchain import Blockchain
+
+DELAYS = [0.2, 0.4, 0.6, 0.8]
+
+
+def stand_in_node(chain, delay, status=200):
+    node = Flask(f'stand-in-{delay}')
+    node.json = wire.JSONProvider(node)
+
+    @node.route('/chain/head')
+    def chain_head():
+        time.sleep(delay)
+        return jsonify({'length': len(chain), 'hash': Blockchain.hash(chain[-1])}), status
+
+    @node.route('/headers')
+    def headers():
+        if 'since_hash' in request.args:
+            # The node we poll from has its own genesis block, so it is never on our chain
+            return jsonify({'message': 'Unknown block hash'}), 404
+        return jsonify({'headers': [Block.header(block) for block in chain], 'length': len(chain)}), status
+
+    @node.route('/chain')
+    def full_chain():
+        start = request.args.get('start', 0, type=int)
+        return jsonify({'chain': chain[start:], 'length': len(chain)}), status
+
+    server = make_server('127.0.0.1', 0, node, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f'127.0.0.1:{server.server_port}'
+
+
+def main():
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+
+    source = Blockchain()
+    for _ in range(5):
+        template = source.block_template(reward_address=source.node_id)
+        source.new_block(source.proof_of_work(template), template=template)
+
+    node = Blockchain()
+    node.peers.deadline = 1.0
+
+    chain = list(source.chain)
+    servers = []
+    for delay in DELAYS:
+        servers.append(stand_in_node(chain, delay))
+    failing = stand_in_node(chain, 0.1, status=500)
+    stalled = stand_in_node(chain, 5.0)
+    servers += [failing, stalled]
+    node.nodes = {address for _, address in servers}
+
+    try:
+        start = time.time()
+        replaced = node.resolve_conflicts()
+        elapsed = time.time() - start
+
+        print(f'replaced: {replaced}, length: {len(node.chain)}')
+        print(f'wall time: {elapsed:.2f}s, slowest healthy peer: {max(DELAYS):.2f}s, '
+              f'sequential sum: {sum(DELAYS):.2f}s')
+        for address, reason in node.unreachable_nodes.items():
+            print(f'skipped {address}: {reason}')
+
+        assert replaced, 'chain was not replaced by the longer one'
+        assert len(node.chain) == len(chain), f'expected {len(chain)} blocks, got {len(node.chain)}'
+        assert elapsed < sum(DELAYS), f'{elapsed:.2f}s is not below the sequential sum {sum(DELAYS):.2f}s'
+        for name, (_, address) in (('failing', failing), ('stalled', stalled)):
+            assert address in node.unreachable_nodes, f'{name} peer {address} not in unreachable_nodes'
+        print('ok')
+    finally:
+        for server, _ in servers:
+            server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,80 @@
+'''
+Fetching investment URL metadata one by one, against the enrichment cache
+
+A local HTTP server stands in for reddit, answering every post after DELAY
+seconds. INVESTMENTS investments share URLS distinct urls, as popular posts do.
+The old investments view fetched every investment's url in turn, every time it
+was opened; the enricher fetches each url once, concurrently, then serves the
+page from its cache.
+Run from the repository root: python benchmarks/bench_enrichment.py
+'''
+import json
+import os
+import random
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from enrichment import Enricher, metadata_url
+
+INVESTMENTS = 200
+URLS = 20
+DELAY = 0.05
+
+
+class Handler(BaseHTTPRequestHandler):
+    requests = 0
+
+    def do_GET(self):
+        Handler.requests += 1
+        time.sleep(DELAY)
+        body = json.dumps([{'kind': 'Listing', 'data': {'children': [
+            {'data': {'title': self.path, 'ups': len(self.path)}}]}}]).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def main():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base = 'http://127.0.0.1:%d' % server.server_address[1]
+
+    rng = random.Random('enrichment')
+    urls = [f'{base}/r/investing/comments/{i}' for i in range(URLS)]
+    investments = [{'sender_address': 'a', 'recipient_address': 'b', 'value': 1, 'url': rng.choice(urls)}
+                   for _ in range(INVESTMENTS)]
+    print(f'{INVESTMENTS} investments over {URLS} urls, {DELAY * 1000:.0f} ms per fetch')
+
+    session = requests.Session()
+    Handler.requests = 0
+    start = time.perf_counter()
+    for investment in investments:
+        session.get(metadata_url(investment['url'])).json()
+    print(f'one by one    {time.perf_counter() - start:8.3f} s  {Handler.requests:4d} fetches')
+
+    # The stand-in is allowed in place of reddit
+    enricher = Enricher(allowed_hosts=('127.0.0.1',))
+    for name in ('enrich, cold', 'enrich, warm'):
+        Handler.requests = 0
+        start = time.perf_counter()
+        enriched = enricher.enrich(investments)
+        elapsed = time.perf_counter() - start
+        assert all('ups' in investment['metadata'] for investment in enriched)
+        print(f'{name:<13} {elapsed:8.3f} s  {Handler.requests:4d} fetches')
+
+    server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
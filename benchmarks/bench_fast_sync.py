@@ -0,0 +1,71 @@
+'''
+Time for a new node to catch up, full validation against a trusted checkpoint
+
+Serves a synthetic chain of BLOCKS blocks with TRANSACTIONS signed transactions
+each from one node of a local cluster, then times a second node catching up the
+usual way and a third node that trusts the first node's checkpoints.
+Run from the repository root: python benchmarks/bench_fast_sync.py
+'''
+import logging
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import bench_gossip
+from run import CHAIN_DIFFICULTY, make_transactions, make_wallets, synthetic_chain
+
+from blockchain import Blockchain
+
+BLOCKS = 500
+TRANSACTIONS = 4
+CHECKPOINT_INTERVAL = 100
+
+
+def main():
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+    directory = tempfile.mkdtemp()
+    try:
+        genesis = os.path.join(directory, 'genesis.db')
+        seed = Blockchain(path=genesis, difficulty=CHAIN_DIFFICULTY)
+        seed.chain.db.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+
+        bench_gossip.NODES = 3
+        bench_gossip.DIFFICULTY = CHAIN_DIFFICULTY
+        os.environ['CHECKPOINT_INTERVAL'] = str(CHECKPOINT_INTERVAL)
+        modules = [module for module, _, _ in bench_gossip.start_cluster(directory, genesis)]
+        source, full, fast = nodes = [module.blockchain for module in modules]
+        for blockchain in nodes:
+            blockchain.on_block = None
+            blockchain.on_transaction = None
+            # Both catch up from the source only, once synced the full node would offer its own checkpoints
+            blockchain.nodes = {modules[0].gossip.address}
+        fast.trusted_checkpoint_keys = {source.node_id}
+
+        rng = random.Random('fast sync')
+        pool = make_transactions(rng, make_wallets(rng, 8), TRANSACTIONS * 64)
+        chain = synthetic_chain(rng, BLOCKS, TRANSACTIONS, pool)
+        source.switch_to(0, chain)
+
+        print(f'{BLOCKS} blocks x {TRANSACTIONS} transactions, checkpoint every {CHECKPOINT_INTERVAL} blocks')
+        for name, blockchain in (('full', full), ('fast', fast)):
+            start = time.perf_counter()
+            assert blockchain.resolve_conflicts() and len(blockchain.chain) == BLOCKS
+            print(f'{name:<5} sync {time.perf_counter() - start:8.2f} s')
+
+        start = time.perf_counter()
+        while fast.checkpoint_status['verified'] is None:
+            time.sleep(0.01)
+        print(f'background check of the trusted blocks: {fast.checkpoint_status["verified"]} '
+              f'after another {time.perf_counter() - start:.2f} s')
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
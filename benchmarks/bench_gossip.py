@@ -0,0 +1,142 @@
+'''
+Block propagation through a local cluster, gossip against polling
+
+Starts NODES copies of app.py in this process, each with its own store and HTTP
+server on a free port, all sharing one genesis block and knowing each other.
+One node mines BLOCKS blocks, a block every BLOCK_GAP seconds, and we time how
+long each block takes to reach every node and count the request and response
+body bytes every server handled, first with gossip announcing every block and
+then with gossip off and every node calling resolve_conflicts every POLL_INTERVAL.
+Run from the repository root: python benchmarks/bench_gossip.py
+'''
+import importlib.util
+import logging
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO)
+
+from werkzeug.serving import make_server
+
+from block import Block
+from blockchain import Blockchain
+
+NODES = 4
+BLOCKS = 5
+BLOCK_GAP = 1.0
+POLL_INTERVAL = 1.0
+# Easy and fixed, the benchmark is about the network not the proof of work
+DIFFICULTY = 256
+TIMEOUT = 30
+
+
+class ByteCounter(object):
+    # WSGI middleware adding up the body bytes of every request and response
+    def __init__(self, app):
+        self.app = app
+        self.bytes = 0
+        self.lock = threading.Lock()
+
+    def count(self, size):
+        with self.lock:
+            self.bytes += size
+
+    def __call__(self, environ, start_response):
+        self.count(int(environ.get('CONTENT_LENGTH') or 0))
+        for chunk in self.app(environ, start_response):
+            self.count(len(chunk))
+            yield chunk
+
+
+def start_cluster(directory, genesis):
+    nodes = []
+    for i in range(NODES):
+        path = os.path.join(directory, f'node{i}.db')
+        shutil.copy(genesis, path)
+        os.environ.update(BLOCKCHAIN_DB=path, DIFFICULTY=str(DIFFICULTY), RETARGET_INTERVAL=str(10 ** 9))
+
+        spec = importlib.util.spec_from_file_location(f'node{i}', os.path.join(REPO, 'app.py'))
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+
+        counter = ByteCounter(module.app.wsgi_app)
+        module.app.wsgi_app = counter
+        server = make_server('127.0.0.1', 0, module.app, threaded=True)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        module.gossip.address = f'127.0.0.1:{server.port}'
+        nodes.append((module, counter, server))
+
+    for module, _, _ in nodes:
+        for other, _, _ in nodes:
+            if other is not module:
+                module.blockchain.register_node(f'http://{other.gossip.address}')
+    return nodes
+
+
+def poll(nodes, stop):
+    # What a network without gossip does, ask every neighbour for its head now and then
+    while not stop.wait(POLL_INTERVAL):
+        for module, _, _ in nodes:
+            module.blockchain.resolve_conflicts()
+
+
+def run(directory, genesis, mode):
+    nodes = start_cluster(directory, genesis)
+    stop = threading.Event()
+    if mode == 'poll':
+        for module, _, _ in nodes:
+            module.blockchain.on_block = None
+            module.blockchain.on_transaction = None
+        threading.Thread(target=poll, args=(nodes, stop), daemon=True).start()
+
+    source = nodes[0][0].blockchain
+    latencies = []
+    start = time.time()
+    for _ in range(BLOCKS):
+        template = source.block_template(reward_address=source.node_id)
+        result = source.miner.mine(Block.work_prefix(template), template['difficulty'])
+        block = source.new_block(result.proof, template=template)
+        sealed = time.time()
+
+        block_hash = source.hash(block)
+        while not all(module.blockchain.block_position(block_hash) is not None for module, _, _ in nodes):
+            if time.time() - sealed > TIMEOUT:
+                raise RuntimeError(f'block did not reach every node within {TIMEOUT}s')
+            time.sleep(0.005)
+        latencies.append(time.time() - sealed)
+        time.sleep(max(BLOCK_GAP - latencies[-1], 0))
+    elapsed = time.time() - start
+
+    stop.set()
+    total = sum(counter.bytes for _, counter, _ in nodes)
+    for _, _, server in nodes:
+        server.shutdown()
+    return latencies, total, elapsed
+
+
+def main():
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+    directory = tempfile.mkdtemp()
+    try:
+        genesis = os.path.join(directory, 'genesis.db')
+        seed = Blockchain(path=genesis, difficulty=DIFFICULTY)
+        seed.chain.db.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+
+        print(f'{NODES} nodes, {BLOCKS} blocks {BLOCK_GAP}s apart, polling every {POLL_INTERVAL}s')
+        for mode in ('gossip', 'poll'):
+            os.mkdir(os.path.join(directory, mode))
+            latencies, total, elapsed = run(os.path.join(directory, mode), genesis, mode)
+            print(f'{mode:<7} propagation mean {sum(latencies) / len(latencies) * 1000:7.1f} ms  '
+                  f'max {max(latencies) * 1000:7.1f} ms  '
+                  f'{total:>8} body bytes  {total / elapsed:8.0f} bytes/s')
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,71 @@
+'''
+Node startup and /wallet/new, with keys generated on the spot against the keystore
+
+Times generating a node key, as every start used to, against reading it back
+from the keystore, which a node now only does once it needs to sign or be paid,
+and checks the node keeps its identity. Then times WALLETS calls to /wallet/new served from
+the background key pool against generating each key pair in the request.
+Run from the repository root: python benchmarks/bench_keys.py
+'''
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from run import load_app
+
+from blockchain import Blockchain
+from keystore import KeyPool, NodeKey, key_path
+
+STARTS = 20
+WALLETS = 200
+
+
+def main():
+    directory = tempfile.mkdtemp()
+    try:
+        path = os.path.join(directory, 'node.db')
+        node_id = Blockchain(path=path).node_id
+
+        start = time.perf_counter()
+        for _ in range(STARTS):
+            KeyPool.generate()
+        generate = (time.perf_counter() - start) / STARTS
+
+        start = time.perf_counter()
+        for _ in range(STARTS):
+            assert NodeKey(key_path(path)).node_id == node_id
+        load = (time.perf_counter() - start) / STARTS
+
+        start = time.perf_counter()
+        for _ in range(STARTS):
+            Blockchain(path=path)
+        restart = (time.perf_counter() - start) / STARTS
+        print(f'node key generated and exported {generate * 1000:6.2f} ms, read from the keystore {load * 1000:6.2f} ms')
+        print(f'node start, the key is only read when first needed {restart * 1000:6.2f} ms')
+
+        module, server = load_app(directory)
+        client = module.app.test_client()
+        for name, pool in (('generated per request', KeyPool(size=0)), ('from the pool', KeyPool(size=WALLETS))):
+            while len(pool) < pool.size:
+                time.sleep(0.01)
+            module.wallet_keys = pool
+            latencies = []
+            for _ in range(WALLETS):
+                start = time.perf_counter()
+                assert client.get('/wallet/new').status_code == 200
+                latencies.append(time.perf_counter() - start)
+            latencies.sort()
+            print(f'/wallet/new {name:<22} median {latencies[len(latencies) // 2] * 1000:6.2f} ms  '
+                  f'p99 {latencies[int(len(latencies) * 0.99)] * 1000:6.2f} ms')
+        server.shutdown()
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,77 @@
+'''
+Memory held by blocks in RAM, plain dicts against compact transactions
+
+Builds the stored JSON of a chain of full blocks holding TRANSACTIONS in total,
+then loads it back the way BlockStore does, once keeping every transaction as
+the dict json.loads gives and once as SignedTransaction, and compares the bytes
+tracemalloc sees allocated. Run from the repository root: python benchmarks/bench_memory.py
+'''
+import gc
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from block import Block
+from blockchain import MAX_BLOCK_TRANSACTIONS
+
+TRANSACTIONS = 100000
+
+
+def stored_chain():
+    # (hash, data) rows as the block store keeps them
+    rows = []
+    for index in range(1, TRANSACTIONS // MAX_BLOCK_TRANSACTIONS + 1):
+        transactions = [{
+            'sender_address': os.urandom(91).hex(),
+            'recipient_address': os.urandom(91).hex(),
+            'value': str(i),
+            'signature': os.urandom(64).hex()
+        } for i in range(MAX_BLOCK_TRANSACTIONS)]
+        fields = {
+            'index': index,
+            'timestamp': time.time(),
+            'transactions': transactions,
+            'proof': index * 7919,
+            'difficulty': 65536,
+            'merkle_root': os.urandom(32).hex(),
+            'previous_hash': os.urandom(32).hex()
+        }
+        rows.append((os.urandom(32).hex(), json.dumps(fields, sort_keys=True)))
+    return rows
+
+
+def as_dicts(rows):
+    return [json.loads(data) for _, data in rows]
+
+
+def as_blocks(rows):
+    return [Block.from_stored(json.loads(data), block_hash) for block_hash, data in rows]
+
+
+def measure(load, rows):
+    gc.collect()
+    tracemalloc.start()
+    blocks = load(rows)
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del blocks
+    return size
+
+
+def main():
+    rows = stored_chain()
+    dicts = measure(as_dicts, rows)
+    blocks = measure(as_blocks, rows)
+
+    print(f'{len(rows)} blocks x {MAX_BLOCK_TRANSACTIONS} transactions')
+    print(f'dicts     {dicts / 2 ** 20:8.1f} MiB  {dicts / TRANSACTIONS:6.0f} bytes per transaction')
+    print(f'compact   {blocks / 2 ** 20:8.1f} MiB  {blocks / TRANSACTIONS:6.0f} bytes per transaction')
+    print(f'ratio {blocks / dicts:.2f}')
+
+
+if __name__ == '__main__':
+    main()
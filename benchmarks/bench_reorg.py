@@ -0,0 +1,131 @@
+'''
+Cost of switching to a heavier fork, against the length of the chain
+
+Two nodes share a synthetic chain of LENGTHS blocks, then each mines a fork of
+its own on top: OURS blocks on the first node, THEIRS on the second, which has
+more work. The first node switches to the second node's fork once through gossip,
+block by block, and once through /nodes/resolve, then the balances, mempool and
+block tree are checked. The time taken should follow the depth of the fork, not
+the length of the chain; downloading every header, which is what a fork used to
+cost before headers could be asked for from a locator, is timed for comparison.
+Run from the repository root: python benchmarks/bench_reorg.py
+'''
+import logging
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import bench_gossip
+from run import BLOCK_INTERVAL, CHAIN_DIFFICULTY, make_transactions, make_wallets, mine_block, synthetic_chain
+
+from accounts import MINING_SENDER
+from block import Block
+from blockchain import Blockchain
+from mempool import transaction_hash
+from merkle import merkle_root
+
+LENGTHS = (200, 1000, 4000)
+TRANSACTIONS = 4
+OURS = 2
+THEIRS = 4
+
+
+def extend(chain, count, transactions, reward_address):
+    # count more valid blocks on top of chain, each holding TRANSACTIONS of transactions
+    blocks = []
+    for _ in range(count):
+        last_block = blocks[-1] if blocks else chain[-1]
+        block_transactions = [transactions.pop() for _ in range(TRANSACTIONS)]
+        block_transactions.append({'sender_address': MINING_SENDER, 'recipient_address': reward_address, 'value': 1})
+
+        index = last_block['index'] + 1
+        blocks.append(mine_block({'index': index, 'timestamp': index * float(BLOCK_INTERVAL),
+                                  'transactions': block_transactions, 'difficulty': CHAIN_DIFFICULTY,
+                                  'merkle_root': merkle_root(block_transactions),
+                                  'previous_hash': last_block.block_hash}))
+    return blocks
+
+
+def run(directory, genesis, length, rng, pool):
+    bench_gossip.NODES = 2
+    bench_gossip.DIFFICULTY = CHAIN_DIFFICULTY
+    (ours, _, _), (theirs, _, _) = bench_gossip.start_cluster(directory, genesis)
+    for module in (ours, theirs):
+        module.blockchain.on_block = None
+        module.blockchain.on_transaction = None
+
+    shared = synthetic_chain(rng, length, 0, None)
+    for module in (ours, theirs):
+        module.blockchain.switch_to(0, shared)
+
+    transactions = [dict(transaction) for transaction in rng.sample(pool, (OURS + THEIRS) * TRANSACTIONS)]
+    our_fork = extend(shared, OURS, transactions, 'ours')
+    their_fork = extend(shared, THEIRS, transactions, 'theirs')
+    theirs.blockchain.switch_to(length, their_fork)
+
+    def reset():
+        ours.blockchain.switch_to(length, our_fork)
+        ours.blockchain.mempool.take(len(ours.blockchain.mempool))
+        assert ours.blockchain.tree.work() < theirs.blockchain.tree.work()
+
+    def check():
+        blockchain = ours.blockchain
+        assert blockchain.hash(blockchain.last_block) == theirs.blockchain.hash(theirs.blockchain.last_block)
+        assert blockchain.tree.work() == theirs.blockchain.tree.work()
+        for address in ('ours', 'theirs'):
+            assert blockchain.accounts.balance(address) == theirs.blockchain.accounts.balance(address)
+        # What only our fork confirmed is pending again, what theirs confirmed is not
+        pending = set(blockchain.mempool.pending)
+        ours_only = set(transaction_hash(transaction) for block in our_fork
+                        for transaction in block['transactions'] if transaction['sender_address'] != MINING_SENDER)
+        assert pending == ours_only
+        assert all(block.block_hash in blockchain.tree for block in our_fork)
+
+    reset()
+    start = time.perf_counter()
+    for block in their_fork:
+        assert ours.blockchain.add_block(Block(dict(block)))
+    gossip = time.perf_counter() - start
+    check()
+
+    reset()
+    start = time.perf_counter()
+    assert ours.blockchain.resolve_conflicts(nodes=[theirs.gossip.address])
+    resolve = time.perf_counter() - start
+    check()
+
+    start = time.perf_counter()
+    headers = list(ours.blockchain.peers.stream(theirs.gossip.address, '/headers', 'headers'))
+    full_headers = time.perf_counter() - start
+    assert len(headers) == length + THEIRS
+
+    print(f'{length:>6} blocks  gossip {gossip * 1000:7.1f} ms  resolve {resolve * 1000:7.1f} ms  '
+          f'every header {full_headers * 1000:7.1f} ms')
+
+
+def main():
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+    directory = tempfile.mkdtemp()
+    try:
+        genesis = os.path.join(directory, 'genesis.db')
+        seed = Blockchain(path=genesis, difficulty=CHAIN_DIFFICULTY)
+        seed.chain.db.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+
+        rng = random.Random('reorg')
+        pool = make_transactions(rng, make_wallets(rng, 8), (OURS + THEIRS) * TRANSACTIONS * 4)
+        print(f'our fork of {OURS} blocks replaced by one of {THEIRS}')
+        for length in LENGTHS:
+            os.mkdir(os.path.join(directory, str(length)))
+            run(os.path.join(directory, str(length)), genesis, length, rng, pool)
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,75 @@
+'''
+Per-signature cost of transaction verification
+
+Compares the original path (import the DER key and build a DSS verifier for
+every transaction) against the cached verifier and the batched verify_many.
+Run from the repository root: python benchmarks/bench_signatures.py
+'''
+import binascii
+import os
+import sys
+import time
+
+from Cryptodome.Hash import SHA256
+from Cryptodome.PublicKey import ECC
+from Cryptodome.Signature import DSS
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import signatures
+from transaction import Transaction
+
+SENDERS = 10
+TRANSACTIONS = 2000
+
+
+def legacy_verify(sender_address, signature, transaction):
+    public_key = ECC.import_key(binascii.unhexlify(sender_address))
+    verifier = DSS.new(public_key, 'fips-186-3')
+    h = SHA256.new(signatures.transaction_message(transaction))
+    try:
+        verifier.verify(h, binascii.unhexlify(signature))
+        return True
+    except ValueError:
+        return False
+
+
+def make_items():
+    wallets = []
+    for _ in range(SENDERS):
+        key = ECC.generate(curve='P-256')
+        wallets.append((binascii.hexlify(key.export_key(format='DER')).decode('ascii'),
+                        binascii.hexlify(key.public_key().export_key(format='DER')).decode('ascii')))
+
+    items = []
+    for i in range(TRANSACTIONS):
+        private_key, address = wallets[i % SENDERS]
+        transaction = Transaction(address, private_key, wallets[(i + 1) % SENDERS][1], i)
+        items.append((address, transaction.sign_transaction(), transaction.to_dict()))
+    return items
+
+
+def timed(name, func):
+    start = time.perf_counter()
+    results = func()
+    elapsed = time.perf_counter() - start
+    assert all(results)
+    print(f'{name:<14} {elapsed / TRANSACTIONS * 1e6:8.1f} us/signature')
+    return elapsed
+
+
+def main():
+    items = make_items()
+    signatures.load_verifier.cache_clear()
+
+    legacy = timed('legacy', lambda: [legacy_verify(*item) for item in items])
+    cached = timed('cached', lambda: [signatures.verify(*item) for item in items])
+    signatures.load_verifier.cache_clear()
+    batched = timed('verify_many', lambda: signatures.verify_many(items))
+
+    print(f'speedup cached: {legacy / cached:.2f}x, verify_many: {legacy / batched:.2f}x '
+          f'on {os.cpu_count()} cores')
+
+
+if __name__ == '__main__':
+    main()
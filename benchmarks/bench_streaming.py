@@ -0,0 +1,135 @@
+'''
+Buffered against streamed chain responses, on the serving and the fetching end
+
+A node serves a synthetic chain of BLOCKS blocks with TRANSACTIONS transactions
+each. On the serving end the whole chain built into one JSON body is compared
+to the block by block stream /chain and /nodes/resolve send, for time to the
+first byte and peak memory. On the fetching end the whole body read and parsed
+at once is compared to PeerClient.stream, for peak memory and for how soon a
+second node's chain is turned down when its block BAD_BLOCK has been tampered with.
+Run from the repository root: python benchmarks/bench_streaming.py
+'''
+import logging
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import bench_gossip
+from run import CHAIN_DIFFICULTY, make_transactions, make_wallets, synthetic_chain
+
+import wire
+from block import Block
+from blockchain import Blockchain
+from merkle import merkle_root
+
+BLOCKS = 1000
+TRANSACTIONS = 20
+BAD_BLOCK = 10
+
+
+def measure(func):
+    # (seconds, peak bytes allocated, result) of one call
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = func()
+    elapsed = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return elapsed, peak, result
+
+
+def report(name, elapsed, peak, extra=''):
+    print(f'{name:<26} {elapsed * 1000:9.1f} ms {peak / 2 ** 20:8.1f} MiB  {extra}')
+
+
+def serving(module):
+    blockchain = module.blockchain
+
+    def buffered():
+        with module.app.app_context():
+            return module.jsonify({'chain': list(blockchain.chain)}).get_data()
+
+    def streamed(first_only):
+        with module.app.test_request_context('/chain'):
+            chunks = module.stream_blocks({}, 'chain').response
+            if first_only:
+                return next(iter(chunks))
+            return sum(len(chunk) for chunk in chunks)
+
+    # Reading the whole chain from the store is part of building the buffered body
+    blockchain.chain.cache.clear()
+    elapsed, peak, _ = measure(buffered)
+    report('serve buffered, first byte', elapsed, peak)
+    blockchain.chain.cache.clear()
+    elapsed, peak, _ = measure(lambda: streamed(True))
+    report('serve streamed, first byte', elapsed, peak)
+    elapsed, peak, size = measure(lambda: streamed(False))
+    report('serve streamed, all', elapsed, peak, f'{size / 2 ** 20:.1f} MiB body')
+
+
+def fetching(blockchain, good, bad, headers):
+    peers = blockchain.peers
+
+    def buffered(node):
+        page = peers.get(node, f'/chain?start=0&limit={BLOCKS}')['chain']
+        return [Block(block) for block in page]
+
+    def streamed(node):
+        return [Block(block) for block in peers.stream(node, f'/chain?start=0&limit={BLOCKS}', 'chain')]
+
+    for name, fetch in (('buffered', buffered), ('streamed', streamed)):
+        elapsed, peak, blocks = measure(lambda: fetch(good))
+        report(f'fetch {name}', elapsed, peak, f'{len(blocks)} blocks')
+
+    def buffered_reject():
+        for block in buffered(bad):
+            if block['merkle_root'] != merkle_root(block['transactions']):
+                return block['index']
+
+    elapsed, peak, index = measure(buffered_reject)
+    report('reject buffered', elapsed, peak, f'at block {index}')
+    elapsed, peak, blocks = measure(lambda: blockchain.fetch_bodies(bad, 0, headers))
+    report('reject streamed', elapsed, peak, f'fetch_bodies -> {blocks}')
+
+
+def main():
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+    directory = tempfile.mkdtemp()
+    try:
+        genesis = os.path.join(directory, 'genesis.db')
+        seed = Blockchain(path=genesis, difficulty=CHAIN_DIFFICULTY)
+        seed.chain.db.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+
+        bench_gossip.NODES = 2
+        bench_gossip.DIFFICULTY = CHAIN_DIFFICULTY
+        nodes = bench_gossip.start_cluster(directory, genesis)
+        (good_module, _, _), (bad_module, _, _) = nodes
+
+        rng = random.Random('streaming')
+        pool = make_transactions(rng, make_wallets(rng, 8), TRANSACTIONS * 16)
+        chain = synthetic_chain(rng, BLOCKS, TRANSACTIONS, pool)
+        good_module.blockchain.switch_to(0, chain)
+
+        # Same header, hence the same hash, but a transaction dropped from the body
+        tampered = list(chain)
+        block = chain[BAD_BLOCK]
+        tampered[BAD_BLOCK] = Block.from_stored(dict(block, transactions=block['transactions'][1:]), block.block_hash)
+        bad_module.blockchain.switch_to(0, tampered)
+
+        print(f'{BLOCKS} blocks x {TRANSACTIONS} transactions, '
+              f'{"msgpack" if wire.msgpack is not None else "JSON"} between nodes')
+        serving(good_module)
+        fetching(good_module.blockchain, good_module.gossip.address, bad_module.gossip.address, chain)
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,65 @@
+'''
+Micro-benchmark for the proof of work check
+
+Compares the original hexdigest based valid_proof against the digest/target
+fast path, both one call per attempt and batched through ProofChecker.scan.
+Run from the repository root: python benchmarks/bench_valid_proof.py
+'''
+import hashlib
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from block import Block
+from merkle import merkle_root
+from proof import ProofChecker, valid_proof
+
+# What the proofs are checked against, the header of a block without its proof
+PREFIX = Block.work_prefix({'index': 2, 'timestamp': 0.0, 'difficulty': 16 ** 4, 'merkle_root': merkle_root([]),
+                            'previous_hash': '00' * 32})
+ATTEMPTS = 200000
+
+
+def legacy_valid_proof(prefix, proof):
+    guess = prefix + f'{proof}'.encode()
+    guess_hash = hashlib.sha256(guess).hexdigest()
+    return guess_hash[:4] == "0000"
+
+
+def legacy_loop():
+    for proof in range(ATTEMPTS):
+        legacy_valid_proof(PREFIX, proof)
+
+
+def fast_loop():
+    for proof in range(ATTEMPTS):
+        valid_proof(PREFIX, proof)
+
+
+def batched():
+    # A huge range would stop at the first hit, so scan in misses-only chunks
+    checker = ProofChecker(PREFIX)
+    start = 0
+    while start < ATTEMPTS:
+        found = checker.scan(start, ATTEMPTS)
+        start = ATTEMPTS if found is None else found + 1
+
+
+def main():
+    # Both checks must agree before their speed means anything
+    for proof in range(ATTEMPTS):
+        assert legacy_valid_proof(PREFIX, proof) == valid_proof(PREFIX, proof)
+
+    results = {}
+    for name, func in (('legacy', legacy_loop), ('valid_proof', fast_loop), ('ProofChecker.scan', batched)):
+        seconds = min(timeit.repeat(func, number=1, repeat=3))
+        results[name] = seconds / ATTEMPTS * 1e9
+        print(f'{name:<20} {results[name]:8.1f} ns/attempt')
+
+    print(f'speedup (scan vs legacy): {results["legacy"] / results["ProofChecker.scan"]:.2f}x')
+
+
+if __name__ == '__main__':
+    main()
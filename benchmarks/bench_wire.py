@@ -0,0 +1,79 @@
+'''
+Bytes on the wire and decode time, JSON against msgpack
+
+Builds a synthetic chain of blocks full of signed-looking transactions and
+compares the size of each encoding and how long a peer takes to decode it.
+Needs msgpack installed. Run from the repository root: python benchmarks/bench_wire.py
+'''
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import wire
+from block import Block
+from transaction import json_default
+
+BLOCKS = 1000
+TRANSACTIONS_PER_BLOCK = 20
+
+
+def synthetic_chain():
+    chain = []
+    previous_hash = 1
+    for index in range(1, BLOCKS + 1):
+        transactions = [{
+            'sender_address': os.urandom(91).hex(),
+            'recipient_address': os.urandom(91).hex(),
+            'value': str(i),
+            'signature': os.urandom(64).hex()
+        } for i in range(TRANSACTIONS_PER_BLOCK)]
+        block = Block({
+            'index': index,
+            'timestamp': time.time(),
+            'transactions': transactions,
+            'proof': index * 7919,
+            'difficulty': 65536,
+            'merkle_root': os.urandom(32).hex(),
+            'previous_hash': previous_hash
+        })
+        previous_hash = block.block_hash
+        chain.append(block)
+    return {'length': len(chain), 'start': 0, 'chain': chain}
+
+
+def timed(func, repeat=5):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def main():
+    if wire.msgpack is None:
+        print('msgpack is not installed, nothing to compare')
+        return
+
+    response = synthetic_chain()
+    as_json = json.dumps(response, default=json_default).encode()
+    as_msgpack = wire.pack(response)
+
+    json_time, from_json = timed(lambda: json.loads(as_json))
+    msgpack_time, from_msgpack = timed(lambda: wire.unpack(as_msgpack))
+    raw_time, _ = timed(lambda: wire.msgpack.unpackb(as_msgpack, raw=False))
+    assert from_json == from_msgpack
+
+    print(f'{BLOCKS} blocks x {TRANSACTIONS_PER_BLOCK} transactions')
+    print(f'json     {len(as_json):>10} bytes  decode {json_time * 1000:8.1f} ms')
+    print(f'msgpack  {len(as_msgpack):>10} bytes  decode {msgpack_time * 1000:8.1f} ms '
+          f'({raw_time * 1000:.1f} ms before turning bytes back into hex)')
+    print(f'size ratio {len(as_msgpack) / len(as_json):.2f}, decode speedup {json_time / msgpack_time:.2f}x')
+
+
+if __name__ == '__main__':
+    main()
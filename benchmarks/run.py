@@ -0,0 +1,357 @@
+'''
+Benchmark suite for the hot paths and the HTTP API
+
+Builds synthetic chains of every size in --sizes with every number of
+transactions per block in --transactions and times, for each chain:
+- build: mining every proof and sealing every block
+- hash: Block.compute_hash over every block, what Blockchain.hash costs for an unsealed block
+- valid_chain: full validation of the chain, proofs, difficulty, merkle roots and signatures
+- store: writing the chain to a BlockStore and validating it from there
+then times proof_of_work at the default difficulty, verify_transaction_signature
+with a cold and a warm key cache, and load tests /chain, /transactions/new and
+/mine with --clients concurrent clients against a local server.
+
+Keys come from a seeded generator and signatures are deterministic (RFC 6979),
+so the same --seed builds the same chains on every run. Results are written as
+JSON to --output, pass an earlier results file to --compare to see the change.
+Run from the repository root: python benchmarks/run.py [--quick]
+'''
+import argparse
+import binascii
+import importlib.util
+import json
+import logging
+import os
+import platform
+import random
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO)
+
+import requests
+from Cryptodome.Hash import SHA256
+from Cryptodome.PublicKey import ECC
+from Cryptodome.Signature import DSS
+from werkzeug.serving import make_server
+
+import signatures
+from block import Block
+from blockchain import Blockchain, MINING_REWARD
+from blockstore import BlockStore
+from merkle import merkle_root
+from proof import DEFAULT_DIFFICULTY, ProofChecker
+
+# Kept low so building 100k blocks takes seconds, proof_of_work is timed on its own
+CHAIN_DIFFICULTY = 16
+BLOCK_INTERVAL = 10
+SENDERS = 8
+# Chains with more transactions than this in total are skipped, signing them takes too long
+MAX_TOTAL_TRANSACTIONS = 20000
+PROOF_OF_WORK_BLOCKS = 5
+
+
+def seeded_bytes(rng):
+    return lambda n: rng.getrandbits(8 * n).to_bytes(n, 'big')
+
+
+def make_wallets(rng, count):
+    wallets = []
+    for _ in range(count):
+        private_key = ECC.generate(curve='P-256', randfunc=seeded_bytes(rng))
+        wallets.append((binascii.hexlify(private_key.public_key().export_key(format='DER')).decode('ascii'),
+                        private_key))
+    return wallets
+
+
+def sign(private_key, transaction):
+    # Same message as Transaction.sign_transaction, with a deterministic nonce
+    signer = DSS.new(private_key, 'deterministic-rfc6979')
+    message = signatures.transaction_message(transaction)
+    return binascii.hexlify(signer.sign(SHA256.new(message))).decode('ascii')
+
+
+def make_transactions(rng, wallets, count):
+    transactions = []
+    for _ in range(count):
+        sender, private_key = rng.choice(wallets)
+        recipient = rng.choice(wallets)[0]
+        value = str(rng.randint(1, 1000))
+        transaction = {'sender_address': sender, 'recipient_address': recipient, 'value': value}
+        transaction['signature'] = sign(private_key, transaction)
+        transactions.append(transaction)
+    return transactions
+
+
+def synthetic_chain(rng, size, per_block, pool):
+    """
+    A valid chain of size blocks, each holding per_block transactions
+    drawn from pool plus a mining reward
+    """
+    genesis = Block({'index': 1, 'timestamp': 0.0, 'transactions': [], 'proof': 100,
+                     'difficulty': CHAIN_DIFFICULTY, 'merkle_root': merkle_root([]), 'previous_hash': 1})
+    chain = [genesis]
+    for index in range(2, size + 1):
+        last_block = chain[-1]
+        transactions = [rng.choice(pool) for _ in range(per_block)] if pool else []
+        transactions.append({'sender_address': 0, 'recipient_address': 'benchmark', 'value': MINING_REWARD})
+
+        chain.append(mine_block({'index': index, 'timestamp': index * float(BLOCK_INTERVAL),
+                                 'transactions': transactions, 'difficulty': CHAIN_DIFFICULTY,
+                                 'merkle_root': merkle_root(transactions), 'previous_hash': last_block.block_hash}))
+    return chain
+
+
+def mine_block(fields):
+    # Seal fields, a block without its proof, with the first proof of work found for them
+    checker = ProofChecker(Block.work_prefix(fields), fields['difficulty'])
+    proof = None
+    start = 0
+    while proof is None:
+        proof = checker.scan(start, start + 256)
+        start += 256
+    return Block(dict(fields, proof=proof))
+
+
+def timed(func, repeat=1):
+    # Best wall time of repeat calls and the last result
+    best = None
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def record(results, name, seconds, items, **extra):
+    entry = {'name': name, 'seconds': seconds, 'items': items,
+             'per_item_us': seconds / items * 1e6 if items else None}
+    entry.update(extra)
+    results.append(entry)
+    print(f'{name:<40} {seconds:10.4f} s  {entry["per_item_us"] or 0:12.2f} us/item')
+
+
+def bench_chains(args, results, directory):
+    rng = random.Random(args.seed)
+    wallets = make_wallets(rng, SENDERS)
+    pool = make_transactions(rng, wallets, max(args.transactions) * 64) if max(args.transactions) else []
+    blockchain = Blockchain(path=':memory:', difficulty=CHAIN_DIFFICULTY,
+                            block_interval=BLOCK_INTERVAL, retarget_interval=10 ** 9)
+
+    for size in args.sizes:
+        for per_block in args.transactions:
+            if size * per_block > MAX_TOTAL_TRANSACTIONS:
+                print(f'skipping {size} blocks x {per_block} transactions, over {MAX_TOTAL_TRANSACTIONS} in total')
+                continue
+            case = f'{size}x{per_block}'
+            chain_rng = random.Random(f'{args.seed}/{case}')
+
+            seconds, chain = timed(lambda: synthetic_chain(chain_rng, size, per_block, pool))
+            record(results, f'build/{case}', seconds, size)
+
+            unsealed = [dict(block) for block in chain]
+            seconds, _ = timed(lambda: [Block.compute_hash(block) for block in unsealed], args.repeat)
+            record(results, f'hash/{case}', seconds, size)
+
+            # Signatures are verified with a cold key cache, as on a fresh node
+            def validate():
+                signatures.load_verifier.cache_clear()
+                return blockchain.valid_chain(chain)
+            seconds, valid = timed(validate, args.repeat)
+            assert valid, 'synthetic chain did not validate'
+            record(results, f'valid_chain/{case}', seconds, size, transactions=size * (per_block + 1))
+
+            path = os.path.join(directory, f'{case}.db')
+            store = BlockStore(path)
+            seconds, _ = timed(lambda: store.splice(0, chain))
+            record(results, f'store_write/{case}', seconds, size)
+            store = BlockStore(path)
+            seconds, valid = timed(lambda: blockchain.valid_chain(store, bodies=False))
+            assert valid, 'stored chain did not validate'
+            record(results, f'store_valid_headers/{case}', seconds, size)
+            store.db.close()
+
+
+def bench_proof_of_work(args, results):
+    blockchain = Blockchain(path=':memory:')
+    attempts = 0
+    start = time.perf_counter()
+    for _ in range(PROOF_OF_WORK_BLOCKS):
+        template = blockchain.block_template(reward_address=blockchain.node_id)
+        result = blockchain.miner.mine(Block.work_prefix(template), DEFAULT_DIFFICULTY)
+        attempts += result.attempts
+        blockchain.new_block(result.proof, template=template)
+    seconds = time.perf_counter() - start
+    record(results, 'proof_of_work', seconds, attempts, blocks=PROOF_OF_WORK_BLOCKS,
+           hash_rate=attempts / seconds, workers=blockchain.miner.workers)
+
+
+def bench_signatures(args, results):
+    rng = random.Random(f'{args.seed}/signatures')
+    wallets = make_wallets(rng, SENDERS)
+    transactions = make_transactions(rng, wallets, args.signatures)
+    blockchain = Blockchain(path=':memory:')
+
+    def verify_all():
+        return all(blockchain.verify_transaction_signature(t['sender_address'], t['signature'], t)
+                   for t in transactions)
+
+    signatures.load_verifier.cache_clear()
+    seconds, valid = timed(verify_all)
+    assert valid
+    record(results, 'verify_signature/cold', seconds, len(transactions))
+    seconds, _ = timed(verify_all, args.repeat)
+    record(results, 'verify_signature/warm', seconds, len(transactions))
+
+
+def load_app(directory):
+    # A fresh copy of app.py on its own store, served on a free port
+    os.environ.update(BLOCKCHAIN_DB=os.path.join(directory, 'api.db'), DIFFICULTY=str(CHAIN_DIFFICULTY),
+                      RETARGET_INTERVAL=str(10 ** 9))
+    spec = importlib.util.spec_from_file_location('benchmark_app', os.path.join(REPO, 'app.py'))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    server = make_server('127.0.0.1', 0, module.app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return module, server
+
+
+def load_test(name, results, clients, calls, url):
+    """
+    Run calls, a list of (method, path, json body), spread over clients
+    threads each with its own session, and record throughput and latency
+    """
+    latencies = []
+    errors = []
+    lock = threading.Lock()
+
+    def client(share):
+        session = requests.Session()
+        for method, path, body in share:
+            start = time.perf_counter()
+            response = session.request(method, url + path, json=body)
+            elapsed = time.perf_counter() - start
+            with lock:
+                latencies.append(elapsed)
+                if response.status_code >= 400:
+                    errors.append(response.status_code)
+
+    threads = [threading.Thread(target=client, args=(calls[i::clients],)) for i in range(clients)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    seconds = time.perf_counter() - start
+
+    latencies.sort()
+    record(results, f'api{name}', seconds, len(calls), clients=clients,
+           requests_per_second=len(calls) / seconds, errors=len(errors),
+           p50_ms=latencies[len(latencies) // 2] * 1000,
+           p95_ms=latencies[int(len(latencies) * 0.95)] * 1000,
+           mean_ms=statistics.mean(latencies) * 1000)
+
+
+def bench_api(args, results, directory):
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+    module, server = load_app(directory)
+    url = f'http://127.0.0.1:{server.port}'
+    blockchain = module.blockchain
+
+    rng = random.Random(f'{args.seed}/api')
+    chain = synthetic_chain(rng, args.api_blocks, 4, make_transactions(rng, make_wallets(rng, SENDERS), 64))
+    blockchain.switch_to(0, chain)
+
+    calls = [('GET', '/chain', None)] * (args.clients * 4)
+    load_test('/chain', results, args.clients, calls, url)
+
+    transactions = make_transactions(rng, make_wallets(rng, SENDERS), args.clients * args.requests)
+    calls = [('POST', '/transactions/new', {'sender_address': t['sender_address'],
+                                            'recipient_address': t['recipient_address'],
+                                            'amount': t['value'], 'signature': t['signature']})
+             for t in transactions]
+    load_test('/transactions/new', results, args.clients, calls, url)
+
+    jobs = args.clients * 2
+    start = time.perf_counter()
+    load_test('/mine', results, args.clients, [('POST', '/mine', None)] * jobs, url)
+    while any(job.status in ('queued', 'running') for job in module.mining_service.jobs.values()):
+        time.sleep(0.01)
+    seconds = time.perf_counter() - start
+    record(results, 'api/mine/completed', seconds, jobs, blocks_per_second=jobs / seconds)
+
+    server.shutdown()
+
+
+def metadata(args):
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=REPO, capture_output=True,
+                                text=True).stdout.strip() or None
+    except OSError:
+        commit = None
+    return {'commit': commit, 'time': time.time(), 'python': platform.python_version(),
+            'platform': platform.platform(), 'cpus': os.cpu_count(), 'args': vars(args)}
+
+
+def compare(results, path):
+    # Print how every benchmark moved against an earlier results file
+    with open(path) as f:
+        before = {entry['name']: entry for entry in json.load(f)['results']}
+    print(f'\ncompared with {path}')
+    for entry in results:
+        old = before.get(entry['name'])
+        if old is None or not old['seconds']:
+            continue
+        ratio = entry['seconds'] / old['seconds']
+        print(f'{entry["name"]:<40} {ratio:6.2f}x time{"  slower" if ratio > 1.1 else ""}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 100000])
+    parser.add_argument('--transactions', type=int, nargs='+', default=[0, 4, 16])
+    parser.add_argument('--signatures', type=int, default=2000)
+    parser.add_argument('--clients', type=int, default=8)
+    parser.add_argument('--requests', type=int, default=50, help='transactions each client submits')
+    parser.add_argument('--api-blocks', type=int, default=1000, help='blocks served by /chain')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--seed', default='benchmark')
+    parser.add_argument('--quick', action='store_true', help='small chains only')
+    parser.add_argument('--output', default='benchmark-results.json')
+    parser.add_argument('--compare', help='an earlier results file')
+    args = parser.parse_args()
+    if args.quick:
+        args.sizes = [size for size in args.sizes if size <= 1000] or [1000]
+        args.transactions = [count for count in args.transactions if count <= 4] or [0]
+        args.signatures = min(args.signatures, 500)
+        args.repeat = 1
+
+    output = os.path.abspath(args.output)
+    compare_with = os.path.abspath(args.compare) if args.compare else None
+    directory = tempfile.mkdtemp()
+    results = []
+    try:
+        bench_chains(args, results, directory)
+        bench_proof_of_work(args, results)
+        bench_signatures(args, results)
+        bench_api(args, results, directory)
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+    with open(output, 'w') as f:
+        json.dump({'meta': metadata(args), 'results': results}, f, indent=2)
+    print(f'\nresults written to {output}')
+    if compare_with:
+        compare(results, compare_with)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,60 @@
+'''
+Sealed blocks that remember their own hash
+
+A block is a fixed-size header (index, timestamp, previous_hash, proof,
+difficulty, merkle_root) and a body of transactions. The block hash covers only
+the header, the merkle_root in it commits to the body, and the proof of work
+covers every other field of the header.
+'''
+import hashlib
+import json
+
+from transaction import compact_transactions, json_default
+
+HEADER_FIELDS = ('index', 'timestamp', 'previous_hash', 'proof', 'difficulty', 'merkle_root')
+
+
+class Block(dict):
+    """
+    A block is sealed when it is created: its canonical serialization is
+    hashed once and the result kept on the block, so Blockchain.hash never
+    has to serialize it again. Blocks must not be modified after sealing.
+    Transactions are kept as compact SignedTransaction objects.
+    """
+    __slots__ = ('block_hash',)
+
+    def __init__(self, *args, **kwargs):
+        dict.__init__(self, *args, **kwargs)
+        if 'transactions' in self:
+            self['transactions'] = compact_transactions(self['transactions'])
+        self.block_hash = self.compute_hash(self)
+
+    @classmethod
+    def from_stored(cls, fields, block_hash):
+        # Rebuild a block that was sealed before, trusting its stored hash
+        block = cls.__new__(cls)
+        dict.update(block, fields)
+        if 'transactions' in block:
+            block['transactions'] = compact_transactions(block['transactions'])
+        block.block_hash = block_hash
+        return block
+
+    @staticmethod
+    def header(block):
+        return {field: block[field] for field in HEADER_FIELDS if field in block}
+
+    @staticmethod
+    def compute_hash(block):
+        return hashlib.sha256(Block.serialize(Block.header(block))).hexdigest()
+
+    @staticmethod
+    def work_prefix(block):
+        # What the proof of work hashes ahead of the proof: the header without its proof
+        fields = Block.header(block)
+        fields.pop('proof', None)
+        return Block.serialize(fields)
+
+    @staticmethod
+    def serialize(block):
+        # Asserts that the block object is ordered
+        return json.dumps(block, sort_keys=True, default=json_default).encode()
@@ -1,140 +1,702 @@
-from collections import OrderedDict
-
-import binascii
-
-import Cryptodome
-import Cryptodome.Random
-from Cryptodome.Hash import SHA256
-from Cryptodome.PublicKey import ECC
-from Cryptodome.Signature import DSS
-
-import hashlib
-import json
-from time import time
+from collections import OrderedDict, deque
+from collections.abc import Mapping
+
+import logging
+import sqlite3
+import threading
+from contextlib import closing
+from time import perf_counter, time
 from uuid import uuid4
 import requests
 
 from flask import Flask, jsonify, request, render_template
 from urllib.parse import urlparse
 
-from transaction import Transaction
+from transaction import Transaction, SignedTransaction
+from block import Block, HEADER_FIELDS
+from merkle import merkle_root
+from blockstore import BlockStore, ForkView
+from accounts import AccountIndex, MINING_SENDER
+from blocktree import BlockTree, chain_work
+import signatures
+from mempool import Mempool, transaction_hash
+from peers import PeerClient
+from miner import ParallelMiner
+from proof import DEFAULT_DIFFICULTY, valid_proof as check_proof
+from metrics import Histogram
+from checkpoint import CHECKPOINT_INTERVAL, block_balances, sign_checkpoint, snapshot, verify_checkpoint
+from keystore import NodeKey, key_path as default_key_path
+
+# Most transactions a block can hold, the mining reward included
+MAX_BLOCK_TRANSACTIONS = 500
+# Blocks to ask a peer for at a time once their headers check out
+BODY_PAGE_SIZE = 1000
+# Block hashes in a locator that are one block apart, the rest are twice as far apart each
+LOCATOR_DENSE = 10
+MINING_REWARD = 1
+
+# Seconds we aim to have between blocks
+BLOCK_INTERVAL = 10
+# Number of blocks between difficulty adjustments
+RETARGET_INTERVAL = 10
+# Most the difficulty can be scaled up or down by in one adjustment
+MAX_RETARGET = 4
+# Retargeting trusts block timestamps, so a block has to be later than the median of this
+# many blocks before it and no more than MAX_FUTURE_SECONDS ahead of our clock
+MEDIAN_TIME_BLOCKS = 11
+MAX_FUTURE_SECONDS = 120
+
+SEAL_SECONDS = Histogram('block_seal_seconds', 'Time taken to build, store and index a mined block')
+
+
+def is_count(value):
+    return isinstance(value, int) and not isinstance(value, bool) and value >= 0
+
+
+def is_time(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def median_time(timestamps):
+    # Median of the timestamps of the blocks before a new one, which has to be later than it
+    timestamps = sorted(timestamps)
+    return timestamps[len(timestamps) // 2] if timestamps else None
+
+
+def valid_head(head):
+    # Whether a peer's /chain/head answer has a length and, if any, a work we can compare
+    return isinstance(head, dict) and is_count(head.get('length')) and ('work' not in head or is_count(head['work']))
 
-class Blockchain(object):
-    def __init__(self):
-        self.chain = []
-        self.nodes = set()
-        # Create a unique global address
-        private_key = ECC.generate(curve='P-256')
-        public_key = private_key.public_key()
-        file_out = open("private.txt", "w")
-        file_out.write(binascii.hexlify(private_key.export_key(format='DER')).decode('ascii'))
 
-        file_out = open("receiver.txt", "w")
-        file_out.write(binascii.hexlify(public_key.export_key(format='DER')).decode('ascii'))
+def valid_header(block):
+    # Whether block has every header field, of a type the checks on it can handle
+    return (isinstance(block, dict) and all(field in block for field in HEADER_FIELDS)
+            and is_count(block['index']) and is_time(block['timestamp'])
+            and isinstance(block['previous_hash'], (str, int)) and not isinstance(block['previous_hash'], bool)
+            and is_count(block['proof']) and is_count(block['difficulty']) and isinstance(block['merkle_root'], str))
 
-        self.node_id = binascii.hexlify(public_key.export_key(format='DER')).decode('ascii')
 
-        self.transactions = []
+def is_scalar(value):
+    return isinstance(value, (str, int, float)) and not isinstance(value, bool)
+
+
+def valid_transaction(transaction):
+    # Whether the fields the signature check and the account index read are there, as scalars
+    if not isinstance(transaction, Mapping) or 'recipient_address' not in transaction:
+        return False
+    sender = transaction.get('sender_address')
+    if not (isinstance(sender, str) or (sender == MINING_SENDER and is_count(sender))):
+        return False
+    return (isinstance(transaction['recipient_address'], str) and is_scalar(transaction.get('value'))
+            and isinstance(transaction.get('signature', ''), str) and isinstance(transaction.get('url', ''), str))
+
+
+def valid_body(block):
+    return isinstance(block.get('transactions'), list) and all(map(valid_transaction, block['transactions']))
+
+
+class Blockchain(object):
+    def __init__(self, path=':memory:', logger=None, difficulty=DEFAULT_DIFFICULTY,
+                 block_interval=BLOCK_INTERVAL, retarget_interval=RETARGET_INTERVAL,
+                 checkpoint_interval=CHECKPOINT_INTERVAL, trusted_checkpoint_keys=(), read_only=False, key_path=None):
+        # Diagnostics go through a logger instead of the console
+        self.logger = logger or logging.getLogger(__name__)
+        # Held while the chain is being extended or replaced
+        self.lock = threading.RLock()
+
+        # Difficulty of the genesis block and the rule for retargeting it,
+        # every node in a network has to agree on these
+        self.initial_difficulty = difficulty
+        self.block_interval = block_interval
+        self.retarget_interval = retarget_interval
+        # The chain lives in a block store on disk at path, read_only replicas
+        # follow a store another process writes to and never change it
+        self.read_only = read_only
+        self.chain = BlockStore(path, read_only=read_only)
+        # Balances and transaction history per address, kept up to date with the chain
+        self.accounts = AccountIndex(self.chain)
+        # Cumulative work along the chain and the side branches we know of, for fork choice
+        self.tree = BlockTree(self.chain)
+        # Our neighbours, kept with the chain so restarts and replicas know them
+        if not read_only:
+            with self.chain.lock, self.chain.db:
+                self.chain.db.execute('CREATE TABLE IF NOT EXISTS nodes (address TEXT PRIMARY KEY)')
+        self.nodes = self.load_nodes()
+        self.peers = PeerClient()
+        # Peers that failed or timed out during the last consensus round
+        self.unreachable_nodes = {}
+        # Our global address and the key that signs our checkpoints, kept next to
+        # the store at key_path (by default the store's path + .key) and only read when needed
+        self.node_key = NodeKey(key_path if key_path is not None else default_key_path(path))
+
+        # Every checkpoint_interval blocks we offer a signed checkpoint, and we
+        # fast sync from checkpoints signed by any of trusted_checkpoint_keys
+        self.checkpoint_interval = checkpoint_interval
+        self.trusted_checkpoint_keys = set(trusted_checkpoint_keys)
+        self.latest_checkpoint = None
+        # Progress of the background check of blocks taken on trust from a checkpoint,
+        # no checkpoints of our own are signed while it runs
+        self.checkpoint_status = None
+        self.verifying = False
+
+        # Pending transactions waiting for the next block
+        self.mempool = Mempool()
+
+        # Mining engine shared by every call to proof_of_work
+        self.miner = ParallelMiner()
+        self.last_mining_result = None
+
+        # Called with every block we seal and every transaction we accept, for gossip
+        self.on_block = None
+        self.on_transaction = None
 
         # I haven't settled on a proof yet, looking into proof of stake
-        self.new_block(previous_hash=1, proof=100)
+        # A node restarting on an existing store keeps its chain
+        if len(self.chain) == 0 and not read_only:
+            self.new_block(previous_hash=1, proof=100)
+
+    @property
+    def node_id(self):
+        return self.node_key.node_id
+
+    @property
+    def node_private_key(self):
+        return self.node_key.private_key
 
     def register_node(self, address):
         # Adds a new node to the set of nodes
         parsed_url = urlparse(address)
         self.nodes.add(parsed_url.netloc)
-
-    def valid_chain(self, chain):
-        # Validate the node's blockchain list
-        last_block = chain[0]
-        current_index = 1
+        with self.chain.lock, self.chain.db:
+            self.chain.db.execute('INSERT OR IGNORE INTO nodes (address) VALUES (?)', (parsed_url.netloc,))
+
+    def load_nodes(self):
+        with self.chain.lock:
+            try:
+                return set(row[0] for row in self.chain.db.execute('SELECT address FROM nodes'))
+            except sqlite3.OperationalError:
+                # A replica started before the writer created the table
+                return set()
+
+    def refresh(self):
+        # For read_only replicas, pick up the blocks and nodes the writer added since the last call
+        if self.chain.refresh():
+            self.nodes = self.load_nodes()
+
+    def valid_chain(self, chain, start=1, bodies=True):
+        # Validate the node's blockchain list, blocks before start are trusted
+        # With bodies=False only the headers are checked, chain may hold headers alone
+        current_index = max(start, 1)
+        last_block = chain[current_index - 1]
+        debug = self.logger.isEnabledFor(logging.DEBUG)
+        checked = []
+        recent = deque((chain[position]['timestamp']
+                        for position in range(max(current_index - MEDIAN_TIME_BLOCKS, 0), current_index)),
+                       maxlen=MEDIAN_TIME_BLOCKS)
+        latest = time() + MAX_FUTURE_SECONDS
+
+        # A chain of our own can't start from an easier genesis block
+        if current_index == 1 and last_block.get('difficulty', DEFAULT_DIFFICULTY) != self.initial_difficulty:
+            return False
 
         while current_index < len(chain):
             block = chain[current_index]
-            print(f'{last_block}')
-            print(f'{block}')
-            print("\n-----------\n")
+            if debug:
+                self.logger.debug('validating %s against %s', block, last_block)
+
+            # Check that the header is complete before reading any of it
+            if not valid_header(block):
+                return False
 
             # Check that the hash of each block is correct
             if block['previous_hash'] != self.hash(last_block):
                 return False
 
-            # Check that the Proof is also correct
-            if not self.valid_proof(last_block['proof'], block['proof']):
+            # Check that the timestamp moves forward and is not in the future, retargeting relies on it
+            if not is_time(block.get('timestamp')) or not median_time(recent) < block['timestamp'] <= latest:
+                return False
+            recent.append(block['timestamp'])
+
+            # Check that the block was mined at the difficulty the retargeting rule asks for
+            difficulty = self.next_difficulty(chain, current_index)
+            if block.get('difficulty', DEFAULT_DIFFICULTY) != difficulty:
+                return False
+
+            # Check that the Proof is also correct, it covers the whole header
+            if not self.valid_proof(block, difficulty):
                 return False
 
+            checked.append(block)
             last_block = block
             current_index += 1
 
-        return True
+        return self.valid_bodies(checked) if bodies else True
+
+    def valid_bodies(self, blocks):
+        # Check that each block's transactions are well formed and match its merkle root
+        for block in blocks:
+            if not valid_body(block) or block.get('merkle_root') != merkle_root(block['transactions']):
+                return False
+
+        # Check every signed transaction in the new blocks in one batch
+        return self.valid_transactions(blocks)
+
+    def next_difficulty(self, chain=None, position=None):
+        """
+        Difficulty the block at position has to be mined at, by default the
+        next block on our own chain
+        - every retarget_interval blocks the difficulty is scaled by how far the
+        last interval's block times were from block_interval, by at most MAX_RETARGET
+        """
+        chain = self.chain if chain is None else chain
+        position = len(chain) if position is None else position
+        if position == 0:
+            return self.initial_difficulty
+
+        last_block = chain[position - 1]
+        difficulty = last_block.get('difficulty', DEFAULT_DIFFICULTY)
+        if position < self.retarget_interval or position % self.retarget_interval != 0:
+            return difficulty
+
+        first_block = chain[position - self.retarget_interval]
+        actual = max(last_block['timestamp'] - first_block['timestamp'], 1e-3)
+        expected = self.block_interval * (self.retarget_interval - 1)
+        factor = min(max(expected / actual, 1 / MAX_RETARGET), MAX_RETARGET)
+        return max(int(difficulty * factor), 1)
+
+    def valid_transactions(self, blocks):
+        # Every block but the genesis block pays exactly one mining reward of MINING_REWARD,
+        # verify the signatures of every other transaction in blocks in one batch
+        items = []
+        for block in blocks:
+            rewards = [transaction['value'] for transaction in block['transactions']
+                       if transaction['sender_address'] == MINING_SENDER]
+            if rewards != ([] if block['index'] == 1 else [MINING_REWARD]):
+                return False
+            items.extend((transaction['sender_address'], transaction.get('signature'), transaction)
+                         for transaction in block['transactions']
+                         if transaction['sender_address'] != MINING_SENDER)
+        return all(signatures.verify_many(items))
+
+    def find_fork(self, chain):
+        """
+        Find the first block of chain that does not build on our own chain,
+        every block before it is one we already hold and validated
+        """
+        for index in range(min(len(self.chain), len(chain) - 1), 0, -1):
+            if chain[index]['previous_hash'] == self.hash(self.chain[index - 1]):
+                return index
+        return 0
 
-    def resolve_conflicts(self):
+    def locator(self):
+        """
+        Hashes of our blocks from the tip down to the genesis block, the first
+        LOCATOR_DENSE one block apart and then twice as far apart each time,
+        a peer on a fork of our chain finds a block it shares with us near the fork
+        """
+        positions = []
+        position = len(self.chain) - 1
+        step = 1
+        while position > 0:
+            positions.append(position)
+            if len(positions) >= LOCATOR_DENSE:
+                step *= 2
+            position -= step
+        positions.append(0)
+        return [self.hash(self.chain[position]) for position in positions]
+
+    def knows_block(self, block_hash):
+        # Whether the block is on our chain or on a side branch we keep
+        return block_hash in self.tree
+
+    def block_position(self, block_hash):
+        # Position of the block with this hash in our chain
+        return self.chain.position(block_hash)
+
+    def stream_headers(self, node, path, until=None):
+        """
+        Download and seal the headers node answers path with, they are checked
+        to be complete and link up as they arrive and the download stops at the first that isn't
+        """
+        headers = []
+        with closing(self.peers.stream(node, path, 'headers', until)) as received:
+            for header in received:
+                if not valid_header(header):
+                    raise ValueError(f'Header {len(headers)} is malformed')
+                header = Block(header)
+                if headers and header['previous_hash'] != self.hash(headers[-1]):
+                    raise ValueError(f'Header {len(headers)} does not link up')
+                headers.append(header)
+        return headers
+
+    def fetch_headers(self, node, until=None):
+        """
+        Download the headers of the part of node's chain we are missing,
+        returns the position the peer's chain leaves ours at and the sealed
+        headers from there on, or (0, None) if the peer could not be reached
+        - the peer is sent our locator and answers from the last block we share
+          that it finds in it, so a fork only costs about its own depth
+        """
+        try:
+            headers = self.stream_headers(node, '/headers?since_hash=' + ','.join(self.locator()), until)
+        except requests.HTTPError as e:
+            if e.response is None or e.response.status_code != 404:
+                self.unreachable_nodes[node] = str(e)
+                return 0, None
+            headers = None
+        except (requests.RequestException, ValueError, KeyError, TypeError) as e:
+            self.unreachable_nodes[node] = str(e) or type(e).__name__
+            return 0, None
+
+        if headers is None:
+            # None of our locator is on the peer's chain, or the peer reads it as one hash, fetch all of it
+            try:
+                headers = self.stream_headers(node, '/headers', until)
+            except (requests.RequestException, ValueError, KeyError, TypeError) as e:
+                self.unreachable_nodes[node] = str(e) or type(e).__name__
+                return 0, None
+            fork = self.find_fork(headers)
+            return fork, headers[fork:]
+
+        if not headers:
+            return len(self.chain), headers
+        position = self.block_position(headers[0]['previous_hash'])
+        if position is None:
+            return 0, None
+        # The block the peer found may be some way below the fork, skip the headers we hold
+        fork = position + 1
+        held = 0
+        while (held < len(headers) and fork + held < len(self.chain)
+               and headers[held].block_hash == self.hash(self.chain[fork + held])):
+            held += 1
+        return fork + held, headers[held:]
+
+    def fetch_bodies(self, node, fork, headers, until=None):
+        """
+        Download the full blocks for headers that were already validated,
+        returns them or None if the peer sends a block that doesn't match its
+        header or merkle root or holds a malformed transaction, which is noticed
+        as soon as that block arrives
+        - signatures are left to valid_transactions, to be checked in one batch
+        - until, a perf_counter() time, is when the download has to be done by
+        """
+        blocks = []
+        while len(blocks) < len(headers):
+            start = fork + len(blocks)
+            received = len(blocks)
+            try:
+                path = f'/chain?start={start}&limit={BODY_PAGE_SIZE}'
+                with closing(self.peers.stream(node, path, 'chain', until)) as page:
+                    for block in page:
+                        block = Block(block)
+                        if block.block_hash != headers[len(blocks)].block_hash:
+                            return None
+                        if not valid_body(block) or block.get('merkle_root') != merkle_root(block['transactions']):
+                            return None
+                        blocks.append(block)
+                        if len(blocks) == len(headers):
+                            break
+            except (requests.RequestException, ValueError, KeyError, TypeError) as e:
+                self.unreachable_nodes[node] = str(e) or type(e).__name__
+                return None
+            if len(blocks) == received:
+                return None
+        return blocks
+
+    def resolve_conflicts(self, nodes=None):
         # Our consensus algorithm that updates to the longest chain in the network
+        # nodes limits the round to some of our neighbours
+
+        neighbours = self.nodes if nodes is None else nodes
+        # Everything we download from peers this round has to be in by then, however slowly they send it
+        until = perf_counter() + self.peers.sync_deadline
+
+        # Only the head of every peer is needed to find the chains with more work than ours,
+        # peers that don't report their work are compared by length
+        heads, self.unreachable_nodes = self.peers.fetch_all(neighbours, '/chain/head')
+        for node, head in list(heads.items()):
+            if not valid_head(head):
+                self.unreachable_nodes[node] = 'Invalid chain head'
+                del heads[node]
+
+        our_work = self.tree.work()
+        heavier = sorted(((head.get('work', 0), head['length'], node) for node, head in heads.items()
+                          if (head['work'] > our_work if 'work' in head else head['length'] > len(self.chain))),
+                         reverse=True)
+
+        # Try the heaviest chain first and settle for the first one that is valid
+        for _, _, node in heavier:
+            # Far behind a peer we trust the checkpoints of, skip checking what they vouch for
+            if self.trusted_checkpoint_keys and self.fast_sync(node, until):
+                return True
+
+            fork, headers = self.fetch_headers(node, until)
+            if headers is None:
+                continue
+
+            # Check the header chain before downloading any transactions
+            with self.lock:
+                if fork > len(self.chain) or self.tree.work(fork) + chain_work(headers) <= self.tree.work():
+                    continue
+                if not self.valid_chain(ForkView(self.chain, fork, headers), start=fork, bodies=False):
+                    continue
+
+            blocks = self.fetch_bodies(node, fork, headers, until)
+            if blocks is None or not self.valid_transactions(blocks):
+                continue
+
+            with self.lock:
+                # Our chain may have grown or moved while we were downloading
+                if fork > len(self.chain) or self.tree.work(fork) + chain_work(blocks) <= self.tree.work():
+                    continue
+                if fork and self.hash(self.chain[fork - 1]) != blocks[0]['previous_hash']:
+                    continue
+
+                self.switch_to(fork, blocks)
+                return True
+
+        return False
 
-        neighbours = self.nodes
-        new_chain = None
+    def checkpoint(self):
+        """
+        Our latest signed checkpoint, made at the last multiple of
+        checkpoint_interval blocks, or None if the chain is not that long yet
+        or holds blocks taken on trust that are still being checked
+        """
+        with self.lock:
+            if self.verifying:
+                return None
+            height = len(self.chain) // self.checkpoint_interval * self.checkpoint_interval
+            if height == 0:
+                return None
+            block_hash = self.hash(self.chain[height - 1])
+
+            latest = self.latest_checkpoint
+            if latest is None or latest['height'] != height or latest['hash'] != block_hash:
+                balances = self.accounts.balances(height)
+                self.latest_checkpoint = sign_checkpoint(height, block_hash, balances, self.node_private_key)
+            return self.latest_checkpoint
+
+    def shares_history(self, node, until=None):
+        # Whether node's chain holds any block of our locator, a peer we can't ask is assumed to
+        try:
+            self.peers.get(node, '/headers?limit=0&since_hash=' + ','.join(self.locator()), until)
+        except requests.HTTPError as e:
+            return e.response is None or e.response.status_code != 404
+        except (requests.RequestException, ValueError):
+            pass
+        return True
 
-        # We are looking for chains that are longer than ours
-        max_length = len(self.chain)
+    def fast_sync(self, node, until=None):
+        """
+        Catch up with node from its latest checkpoint if it is signed by a key
+        we trust and at least checkpoint_interval blocks ahead of us, or ahead of
+        us on a chain we share no block with, returns <bool>
+        - blocks up to the checkpoint only have to link up to its hash and match
+          their merkle roots and its balances, the blocks after it are validated in full
+        - the blocks taken on trust are validated in full in the background afterwards,
+          if they turn out invalid we go back to the chain we had
+        """
+        try:
+            checkpoint = self.peers.get(node, '/checkpoints/latest', until)
+        except (requests.RequestException, ValueError):
+            return False
+        if not verify_checkpoint(checkpoint, self.trusted_checkpoint_keys):
+            return False
+        height = checkpoint['height']
+        if height <= len(self.chain):
+            return False
+        # A little behind, fetching the missing blocks and checking them costs less than starting over
+        if height - len(self.chain) < self.checkpoint_interval and self.shares_history(node, until):
+            return False
 
-        # Check all the chains in our network
-        for node in neighbours:
-            response = requests.get(f'http://{node}/chain')
+        try:
+            # Checked to link up as they arrive
+            headers = self.stream_headers(node, '/headers', until)
+        except (requests.RequestException, ValueError, KeyError, TypeError) as e:
+            self.unreachable_nodes[node] = str(e) or type(e).__name__
+            return False
+        if len(headers) < height or self.hash(headers[height - 1]) != checkpoint['hash']:
+            return False
+        if not self.valid_chain(headers, start=height, bodies=False):
+            return False
 
-            if response.status_code == 200:
-                length = response.json()['length']
-                chain = response.json()['chain']
+        blocks = self.fetch_bodies(node, 0, headers, until)
+        # Merkle roots are checked as the blocks arrive
+        if blocks is None:
+            return False
+        if block_balances(blocks[:height]) != snapshot(checkpoint['balances']):
+            return False
+        if not self.valid_transactions(blocks[height:]):
+            return False
 
-                # Check for a longer chain and check its validity
-                if length > max_length and self.valid_chain(chain):
-                    max_length = length
-                    new_chain = chain
+        with self.lock:
+            if chain_work(blocks) <= self.tree.work():
+                return False
+            previous = self.switch_to(0, blocks)
+            self.checkpoint_status = {'height': height, 'hash': checkpoint['hash'],
+                                      'signer': checkpoint['signer'], 'verified': None}
+            self.verifying = True
 
-        if new_chain:
-            self.chain = new_chain
-            return True
+        threading.Thread(target=self.verify_history, args=(self.checkpoint_status, previous),
+                         name='checkpoint', daemon=True).start()
+        return True
 
-        return False
+    def holds_checkpoint(self, status):
+        return len(self.chain) >= status['height'] and self.hash(self.chain[status['height'] - 1]) == status['hash']
 
-    def new_block(self, proof, previous_hash=None):
+    def verify_history(self, status, previous):
+        """
+        Validate in full the blocks a checkpoint let us skip, records the outcome in status
+        - if they are invalid the signer is no longer trusted and, unless our chain
+          moved off them since, previous (the chain we had before) is restored
+        """
+        try:
+            with self.lock:
+                if not self.holds_checkpoint(status):
+                    # Replaced by a longer chain since, which was checked in full
+                    status['verified'] = None
+                    return
+                trusted = ForkView(self.chain, status['height'], [])
+
+            verified = self.valid_chain(trusted)
+            with self.lock:
+                status['verified'] = verified
+                if verified:
+                    return
+                self.logger.error('blocks up to checkpoint %s signed by %s are NOT valid',
+                                  status['hash'], status['signer'])
+                self.trusted_checkpoint_keys.discard(status['signer'])
+                if self.holds_checkpoint(status):
+                    self.switch_to(0, previous, keep=False)
+                    status['rolled_back'] = True
+        finally:
+            self.verifying = False
+
+    def block_template(self, reward_address=None, previous_hash=None):
+        """
+        The next block on our chain without its proof, for the proof of work to
+        commit to: the best pending transactions, a reward for reward_address if
+        given, and the header fields
+        - the transactions stay in the mempool until the block is sealed
+        """
+        transactions = self.mempool.peek(MAX_BLOCK_TRANSACTIONS - (reward_address is not None))
+        if reward_address is not None:
+            transactions.append(SignedTransaction(MINING_SENDER, reward_address, MINING_REWARD))
+
+        with self.lock:
+            # Never earlier than the blocks before it allow, however far off their clocks were
+            earliest = median_time(block['timestamp'] for block in self.chain[-MEDIAN_TIME_BLOCKS:])
+            return {
+                'index': len(self.chain) + 1,
+                'timestamp': time() if earliest is None else max(time(), earliest + 1e-3),
+                'transactions': transactions,
+                'difficulty': self.next_difficulty(),
+                'merkle_root': merkle_root(transactions),
+                'previous_hash': previous_hash or self.hash(self.chain[-1])
+            }
+
+    def new_block(self, proof, previous_hash=None, reward_address=None, template=None):
         # this method should create a new block and add it to the chain
-        block = {
-            'index': len(self.chain) + 1,
-            'timestamp': time(),
-            'transactions': self.transactions,
-            'proof': proof,
-            'previous_hash': previous_hash or self.hash(self.chain[-1])
-        }
+        # template is what proof was mined for, by default a new one (only the genesis block has no proof to check)
+        if template is None:
+            template = self.block_template(reward_address, previous_hash)
 
-        # Clear transactions on creation of new block
-        self.transactions = []
+        with self.lock, SEAL_SECONDS.time():
+            block = Block(dict(template, proof=proof))
 
-        # add new block to the chain
-        self.chain.append(block)
+            # add new block to the chain, its transactions leave the mempool
+            self.switch_to(len(self.chain), [block])
 
+        if self.on_block is not None:
+            self.on_block(block)
         return block
 
+    def add_block(self, block):
+        """
+        Add a valid block a peer announced whose parent we know, returns <bool>
+        - on our tip it is appended, elsewhere it is kept on a side branch
+        - a side branch with more work than our chain becomes our chain,
+          only the blocks after the fork are rolled back and applied
+        """
+        with self.lock:
+            block_hash = self.hash(block)
+            if block_hash in self.tree:
+                return False
+
+            found = self.tree.branch(block.get('previous_hash'))
+            if found is None:
+                return False
+            fork, branch = found
+            candidate = ForkView(self.chain, fork, branch + [block])
+            if not self.valid_chain(candidate, start=len(candidate) - 1):
+                return False
+
+            work = self.tree.work(fork) + chain_work(branch + [block])
+            if work > self.tree.work():
+                self.switch_to(fork, branch + [block])
+            else:
+                self.tree.add_side(block, len(candidate) - 1, work)
+        return True
+
+    def switch_to(self, fork, blocks, keep=True):
+        """
+        Make blocks our chain from position fork onwards, returns the blocks
+        rolled back, which stay in the block tree as a side branch
+        - the block store, the block tree and the balances change in one transaction
+        - balances and the mempool are updated for the blocks that changed only:
+          what blocks confirm leaves the mempool, what only the rolled back
+          blocks confirmed goes back to it
+        - keep=False forgets the rolled back blocks instead, for blocks that were
+          never checked in full: no side branch and nothing back to the mempool
+        """
+        with self.lock:
+            rolled_back = self.chain[fork:]
+            # All or nothing, a crash part way must not leave balances or work for the wrong branch
+            with self.chain.transaction():
+                if keep:
+                    self.tree.retire(fork, rolled_back)
+                self.chain.splice(fork, blocks)
+                self.tree.add_main(fork, blocks)
+                self.accounts.add_blocks(fork, blocks)
+
+            confirmed = [transaction for block in blocks for transaction in block['transactions']]
+            self.mempool.discard(confirmed)
+            if rolled_back and keep:
+                confirmed = set(transaction_hash(transaction) for transaction in confirmed)
+                for block in rolled_back:
+                    for transaction in block['transactions']:
+                        if (transaction['sender_address'] != MINING_SENDER
+                                and transaction_hash(transaction) not in confirmed):
+                            self.mempool.add(transaction)
+                self.tree.prune()
+        return rolled_back
+
+    def add_pending(self, transaction):
+        # Add a verified transaction to the mempool, duplicates and transactions
+        # the full mempool has no room for are refused
+        if not self.mempool.add(transaction):
+            return False
+        if self.on_transaction is not None:
+            self.on_transaction(transaction)
+        return True
+
 
     def verify_transaction_signature(self, sender_address, signature, transaction):
         """
         Check that the provided signature corresponds to transaction
         signed by the public key (sender_address)
         """
-        public_key = ECC.import_key(binascii.unhexlify(sender_address))
-        verifier = DSS.new(public_key, 'fips-186-3')
-        h = SHA256.new(str(transaction).encode('utf8'))
-        try:
-            verifier.verify(h, binascii.unhexlify(signature))
+        if signatures.verify(sender_address, signature, transaction):
             return True
-        except ValueError:
-            print('this signature is NOT authentic')
-            return False
-        # return verifier.verify(h, binascii.unhexlify(signature))
+
+        self.logger.info('this signature is NOT authentic')
+        return False
 
 
     def submit_transaction(self, sender_address, recipient_address, value, signature, url=None):
         """
-        Add a transaction to transactions array if the signature verified
+        Add a transaction to the mempool if the signature verified
         """
         if url == None:
             transaction = OrderedDict({'sender_address': sender_address,
@@ -147,52 +709,82 @@ class Blockchain(object):
                                     'value': value,
                                     'url': url
                                     })
-        #Reward for mining a block
-        if sender_address == 0:
-            self.transactions.append(transaction)
+        #Manages transactions from wallet to another wallet, mining rewards are only made by block_template
+        transaction_verification = self.verify_transaction_signature(
+            sender_address, signature, transaction)
+        if transaction_verification:
+            # Keep the signature so peers can verify the transaction in our blocks
+            transaction = SignedTransaction(signature=signature, **transaction)
+            if not self.add_pending(transaction):
+                return False
             return len(self.chain) + 1
-        #Manages transactions from wallet to another wallet
         else:
-            transaction_verification = self.verify_transaction_signature(
-                sender_address, signature, transaction)
-            if transaction_verification:
-                self.transactions.append(transaction)
-                return len(self.chain) + 1
-            else:
-                return False
+            return False
+
+
+    def submit_transactions(self, transactions):
+        """
+        Add many transactions to the mempool, verifying all of their signatures in one batch,
+        returns the next block index or False for each transaction like submit_transaction
+        - transactions is a list of dicts with sender_address, recipient_address, value,
+          signature and optionally url
+        """
+        unsigned = []
+        for values in transactions:
+            transaction = OrderedDict((field, values[field])
+                                      for field in ('sender_address', 'recipient_address', 'value'))
+            if values.get('url') is not None:
+                transaction['url'] = values['url']
+            unsigned.append(transaction)
+
+        # Mining rewards only come from block_template, a client can't send one
+        signed = [position for position, transaction in enumerate(unsigned)
+                  if transaction['sender_address'] != MINING_SENDER]
+        verified = signatures.verify_many((unsigned[position]['sender_address'],
+                                           transactions[position]['signature'],
+                                           unsigned[position]) for position in signed)
+        valid = set(position for position, ok in zip(signed, verified) if ok)
+
+        results = []
+        for position, transaction in enumerate(unsigned):
+            if position not in valid:
+                results.append(False)
+                continue
+            transaction = SignedTransaction(signature=transactions[position]['signature'], **transaction)
+            results.append(len(self.chain) + 1 if self.add_pending(transaction) else False)
+
+        if len(valid) < len(signed):
+            self.logger.info('%d of %d signatures are NOT authentic', len(signed) - len(valid), len(signed))
+        return results
 
 
     @staticmethod
     def hash(block):
-        # hashes a passed in block using SHA-256
-
-        # Asserts that the block object is ordered
-        block_string = json.dumps(block, sort_keys=True).encode()
+        # hashes a passed in block using SHA-256, sealed blocks already know their hash
+        if isinstance(block, Block):
+            return block.block_hash
 
-        return hashlib.sha256(block_string).hexdigest()
+        return Block.compute_hash(block)
 
     @property
     def last_block(self):
         # gets the last block in the chain
         return self.chain[-1]
 
-    def proof_of_work(self, last_proof):
+    def proof_of_work(self, block):
         """
         Proof of Work Algorithm:
-        - Find a number p' such that hash(p*p') contains leading 4 zeroes,
-        and where p is the previous proof nad p' is the new proof
+        - Find a number p such that hash(header + p) is below the target of the
+        block's difficulty, where header is everything in the block's header but the proof
+        - block is a block_template, the proof found is only valid for it
+        - The search is spread across every core by the ParallelMiner
         """
 
-        proof = 0
-        while self.valid_proof(last_proof, proof) is False:
-            proof += 1
+        self.last_mining_result = self.miner.mine(Block.work_prefix(block), block['difficulty'])
 
-        return proof
+        return self.last_mining_result.proof
 
     @staticmethod
-    def valid_proof(last_proof, proof):
-        # validates the proof, returns <bool>
-
-        guess = f'{last_proof}{proof}'.encode()
-        guess_hash = hashlib.sha256(guess).hexdigest()
-        return guess_hash[:4] == "0000"
\ No newline at end of file
+    def valid_proof(block, difficulty=DEFAULT_DIFFICULTY):
+        # validates the proof of a block against its header, returns <bool>
+        return check_proof(Block.work_prefix(block), block['proof'], difficulty)
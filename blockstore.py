@@ -0,0 +1,197 @@
+'''
+Persistent append-only block store
+
+Blocks are kept in a SQLite table keyed by their position in the chain, along with
+their hash and canonical JSON, so a restarted node picks up its chain without
+re-hashing or re-syncing anything. Only the most recently used blocks are kept
+in RAM, everything else is read from disk on demand. Other processes can open the
+same database read only and follow the chain as it changes.
+'''
+import json
+import os
+import sqlite3
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from urllib.request import pathname2url
+
+from block import Block
+
+# How many blocks to keep in RAM
+CACHE_SIZE = 256
+# How many rows to pull from disk at a time while iterating
+BATCH_SIZE = 500
+
+
+class BlockStore(object):
+    """
+    List-like view of the chain, supports len(), indexing, slicing,
+    iteration and append like the list it replaces
+    """
+
+    def __init__(self, path=':memory:', cache_size=CACHE_SIZE, read_only=False):
+        self.lock = threading.RLock()
+        self.cache = OrderedDict()
+        self.cache_size = cache_size
+        self.read_only = read_only
+        # How many transaction() blocks the thread holding the lock is inside
+        self.depth = 0
+
+        if read_only:
+            # Another process owns the database and writes to it, call refresh to see its changes
+            uri = 'file:' + pathname2url(os.path.abspath(path)) + '?mode=ro'
+            self.db = sqlite3.connect(uri, uri=True, check_same_thread=False)
+            self.version = None
+            self.refresh()
+            return
+
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        with self.lock, self.db:
+            self.db.execute('PRAGMA journal_mode=WAL')
+            self.db.execute('PRAGMA synchronous=NORMAL')
+            self.db.execute('CREATE TABLE IF NOT EXISTS blocks ('
+                            'position INTEGER PRIMARY KEY, hash TEXT NOT NULL, data TEXT NOT NULL)')
+            self.db.execute('CREATE INDEX IF NOT EXISTS blocks_hash ON blocks (hash)')
+            self.length = self.db.execute('SELECT COALESCE(MAX(position) + 1, 0) FROM blocks').fetchone()[0]
+
+    def __len__(self):
+        return self.length
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            start, stop, step = key.indices(self.length)
+            blocks = list(self.iter(start, stop)) if start < stop else []
+            return blocks[::step] if step != 1 else blocks
+
+        position = key + self.length if key < 0 else key
+        if not 0 <= position < self.length:
+            raise IndexError('block index out of range')
+
+        with self.lock:
+            block = self.cache.get(position)
+            if block is not None:
+                self.cache.move_to_end(position)
+                return block
+
+            row = self.db.execute('SELECT hash, data FROM blocks WHERE position = ?', (position,)).fetchone()
+            block = Block.from_stored(json.loads(row[1]), row[0])
+            self.remember(position, block)
+            return block
+
+    def __iter__(self):
+        return self.iter()
+
+    def refresh(self):
+        """
+        Pick up blocks another connection wrote since the last call,
+        returns True if the database changed
+        """
+        with self.lock:
+            version = self.db.execute('PRAGMA data_version').fetchone()[0]
+            if version == self.version:
+                return False
+            self.version = version
+            self.cache.clear()
+            self.length = self.db.execute('SELECT COALESCE(MAX(position) + 1, 0) FROM blocks').fetchone()[0]
+            return True
+
+    @contextmanager
+    def transaction(self):
+        """
+        Hold the lock and commit what is written inside in one SQLite transaction,
+        or roll all of it back on an error. Nested calls join the outermost one, so
+        the other tables of the database can be changed together with the blocks
+        """
+        with self.lock:
+            self.depth += 1
+            try:
+                if self.depth > 1:
+                    yield
+                    return
+                try:
+                    with self.db:
+                        yield
+                except BaseException:
+                    # Forget the blocks of the rolled back transaction
+                    self.cache.clear()
+                    self.length = self.db.execute('SELECT COALESCE(MAX(position) + 1, 0) FROM blocks').fetchone()[0]
+                    raise
+            finally:
+                self.depth -= 1
+
+    def remember(self, position, block):
+        self.cache[position] = block
+        self.cache.move_to_end(position)
+        while len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+
+    def rows(self, start=0, stop=None):
+        # Yields (hash, data) for the blocks in [start, stop), reading a batch at a time
+        stop = self.length if stop is None else min(stop, self.length)
+        while start < stop:
+            with self.lock:
+                rows = self.db.execute(
+                    'SELECT hash, data FROM blocks WHERE position >= ? AND position < ? '
+                    'ORDER BY position LIMIT ?', (start, stop, BATCH_SIZE)).fetchall()
+            if not rows:
+                return
+            yield from rows
+            start += len(rows)
+
+    def iter(self, start=0, stop=None):
+        for block_hash, data in self.rows(start, stop):
+            yield Block.from_stored(json.loads(data), block_hash)
+
+    def iter_json(self, start=0, stop=None):
+        # The stored canonical JSON of each block, for streaming without re-serializing
+        for _, data in self.rows(start, stop):
+            yield data
+
+    def position(self, block_hash):
+        # Position of the block with this hash or None
+        with self.lock:
+            row = self.db.execute('SELECT MAX(position) FROM blocks WHERE hash = ?', (block_hash,)).fetchone()
+        return row[0]
+
+    def append(self, block):
+        self.splice(self.length, [block])
+
+    def splice(self, position, blocks):
+        """
+        Replace every block from position onwards with blocks,
+        in one transaction so a crash leaves either the old or the new chain
+        """
+        with self.transaction():
+            self.db.execute('DELETE FROM blocks WHERE position >= ?', (position,))
+            self.db.executemany(
+                'INSERT INTO blocks (position, hash, data) VALUES (?, ?, ?)',
+                ((position + offset, block.block_hash, Block.serialize(block).decode())
+                 for offset, block in enumerate(blocks)))
+
+            for cached in [p for p in self.cache if p >= position]:
+                del self.cache[cached]
+            for offset, block in enumerate(blocks):
+                self.remember(position + offset, block)
+            self.length = position + len(blocks)
+
+
+class ForkView(object):
+    """
+    A candidate chain made of the first `fork` blocks of a store followed by
+    new blocks, without copying the shared prefix
+    """
+
+    def __init__(self, store, fork, blocks):
+        self.store = store
+        self.fork = fork
+        self.blocks = blocks
+
+    def __len__(self):
+        return self.fork + len(self.blocks)
+
+    def __getitem__(self, position):
+        if position < 0:
+            position += len(self)
+        if position >= self.fork:
+            return self.blocks[position - self.fork]
+        return self.store[position]
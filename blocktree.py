@@ -0,0 +1,134 @@
+'''
+Block tree over the chain in the block store
+
+Our chain is the heaviest branch of a tree of every valid block we know: the one
+with the most cumulative work, the sum of the difficulties of its blocks. The
+other branches are kept in a side table by hash, and the cumulative work at every
+position of our chain is kept next to it, so when another branch overtakes ours
+finding the fork, comparing the work of both sides and swapping them only touches
+the blocks after the fork, however long the chain is.
+'''
+import json
+
+from block import Block
+from proof import DEFAULT_DIFFICULTY
+
+# Side blocks further than this below our tip are forgotten
+SIDE_BLOCK_DEPTH = 1000
+
+
+def block_work(block):
+    # Work a block stands for, the number of hashes its proof is expected to take
+    return int(block.get('difficulty', DEFAULT_DIFFICULTY))
+
+
+def chain_work(blocks):
+    return sum(block_work(block) for block in blocks)
+
+
+class BlockTree(object):
+    def __init__(self, store):
+        self.store = store
+        self.db = store.db
+        self.lock = store.lock
+
+        if store.read_only:
+            # Kept up to date by the process that writes the store
+            return
+
+        with self.lock, self.db:
+            self.db.execute('CREATE TABLE IF NOT EXISTS chain_work ('
+                            'position INTEGER PRIMARY KEY, work INTEGER NOT NULL)')
+            self.db.execute('CREATE TABLE IF NOT EXISTS side_blocks ('
+                            'hash TEXT PRIMARY KEY, previous_hash TEXT NOT NULL, position INTEGER NOT NULL, '
+                            'work INTEGER NOT NULL, data TEXT NOT NULL)')
+            self.db.execute('CREATE INDEX IF NOT EXISTS side_blocks_position ON side_blocks (position)')
+
+        # Catch up with the block store if we stopped between writing blocks and recording their work
+        self.sync()
+
+    def sync(self):
+        with self.lock:
+            height = self.db.execute('SELECT COALESCE(MAX(position) + 1, 0) FROM chain_work').fetchone()[0]
+            if height > len(self.store):
+                with self.db:
+                    self.db.execute('DELETE FROM chain_work WHERE position >= ?', (len(self.store),))
+            elif height < len(self.store):
+                self.add_main(height, self.store.iter(height))
+
+    def work(self, height=None):
+        # Cumulative work of the first height blocks of our chain, all of it by default
+        height = len(self.store) if height is None else height
+        if height <= 0:
+            return 0
+        with self.lock:
+            row = self.db.execute('SELECT work FROM chain_work WHERE position = ?', (height - 1,)).fetchone()
+        return row[0] if row else 0
+
+    def add_main(self, position, blocks):
+        # Record the work of blocks stored from position onwards, they are on our chain now
+        total = self.work(position)
+        rows = []
+        for offset, block in enumerate(blocks):
+            total += block_work(block)
+            rows.append((position + offset, total, block.block_hash))
+
+        with self.store.transaction():
+            self.db.execute('DELETE FROM chain_work WHERE position >= ?', (position,))
+            self.db.executemany('INSERT INTO chain_work (position, work) VALUES (?, ?)',
+                                ((row_position, work) for row_position, work, _ in rows))
+            self.db.executemany('DELETE FROM side_blocks WHERE hash = ?', ((block_hash,) for _, _, block_hash in rows))
+
+    def retire(self, position, blocks):
+        # Keep blocks, leaving our chain from position onwards, as a side branch
+        total = self.work(position)
+        rows = []
+        for offset, block in enumerate(blocks):
+            total += block_work(block)
+            rows.append((block.block_hash, block['previous_hash'], position + offset, total,
+                         Block.serialize(block).decode()))
+        with self.store.transaction():
+            self.db.executemany('INSERT OR IGNORE INTO side_blocks VALUES (?, ?, ?, ?, ?)', rows)
+
+    def add_side(self, block, position, work):
+        # Keep a valid block that is not on our chain, position is where it would sit and work its branch's
+        with self.store.transaction():
+            self.db.execute('INSERT OR IGNORE INTO side_blocks VALUES (?, ?, ?, ?, ?)',
+                            (block.block_hash, block['previous_hash'], position, work,
+                             Block.serialize(block).decode()))
+
+    def prune(self):
+        # Forget side blocks too far below our tip to ever overtake it
+        with self.store.transaction():
+            self.db.execute('DELETE FROM side_blocks WHERE position < ?', (len(self.store) - SIDE_BLOCK_DEPTH,))
+
+    def __contains__(self, block_hash):
+        if self.store.position(block_hash) is not None:
+            return True
+        with self.lock:
+            row = self.db.execute('SELECT 1 FROM side_blocks WHERE hash = ?', (block_hash,)).fetchone()
+        return row is not None
+
+    def branch(self, block_hash):
+        """
+        The branch ending with the block block_hash, as (fork, blocks) where
+        blocks are the side blocks leading to it, oldest first, that would
+        follow the first fork blocks of our chain
+        - (position + 1, []) for a block on our chain, None for a block we don't know
+        """
+        blocks = []
+        with self.lock:
+            while True:
+                row = self.db.execute('SELECT previous_hash, data FROM side_blocks WHERE hash = ?',
+                                      (block_hash,)).fetchone()
+                if row is None:
+                    break
+                blocks.append(Block.from_stored(json.loads(row[1]), block_hash))
+                block_hash = row[0]
+
+            position = self.store.position(block_hash)
+        if position is None:
+            # Unknown, or a branch whose base was pruned
+            return None
+        blocks.reverse()
+        return position + 1, blocks
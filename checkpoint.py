@@ -0,0 +1,66 @@
+'''
+Signed checkpoints for fast sync
+
+Every CHECKPOINT_INTERVAL blocks a node can vouch for its chain: a checkpoint
+names a height, the hash of the block at that height and every address's
+balance up to it, signed with the node's key. A new node that trusts the
+signer takes the blocks up to the checkpoint as valid once their hashes link up
+to it and their merkle roots match, and only checks proofs and signatures for
+the blocks after it. The full history is still verified, in the background.
+'''
+import binascii
+import json
+from collections import defaultdict
+
+from Cryptodome.Hash import SHA256
+from Cryptodome.PublicKey import ECC
+from Cryptodome.Signature import DSS
+
+from accounts import transaction_rows
+
+CHECKPOINT_INTERVAL = 100
+# Balances are compared to this many decimals, sums of floats depend on their order
+BALANCE_DIGITS = 8
+
+
+def snapshot(balances):
+    return {address: round(balance, BALANCE_DIGITS) for address, balance in balances.items()}
+
+
+def block_balances(blocks):
+    # Balances after blocks, the same sums the account index keeps
+    balances = defaultdict(float)
+    for _, _, address, delta, _, _ in transaction_rows(0, blocks):
+        balances[address] += delta
+    return snapshot(balances)
+
+
+def checkpoint_message(checkpoint):
+    # Everything but the signature, in canonical JSON
+    fields = {key: value for key, value in checkpoint.items() if key != 'signature'}
+    return json.dumps(fields, sort_keys=True).encode()
+
+
+def sign_checkpoint(height, block_hash, balances, private_key):
+    """
+    Checkpoint of the first height blocks, the last of which has block_hash,
+    signed with private_key (an ECC key)
+    """
+    signer = binascii.hexlify(private_key.public_key().export_key(format='DER')).decode('ascii')
+    checkpoint = {'height': height, 'hash': block_hash, 'balances': snapshot(balances), 'signer': signer}
+    signature = DSS.new(private_key, 'fips-186-3').sign(SHA256.new(checkpoint_message(checkpoint)))
+    checkpoint['signature'] = binascii.hexlify(signature).decode('ascii')
+    return checkpoint
+
+
+def verify_checkpoint(checkpoint, trusted_keys):
+    # Whether checkpoint is well formed and signed by one of trusted_keys, returns <bool>
+    try:
+        if checkpoint['signer'] not in trusted_keys or checkpoint['height'] < 1:
+            return False
+        public_key = ECC.import_key(binascii.unhexlify(checkpoint['signer']))
+        DSS.new(public_key, 'fips-186-3').verify(SHA256.new(checkpoint_message(checkpoint)),
+                                                  binascii.unhexlify(checkpoint['signature']))
+        return isinstance(checkpoint['hash'], str) and isinstance(checkpoint['balances'], dict)
+    except (ValueError, TypeError, KeyError, IndexError, binascii.Error):
+        return False
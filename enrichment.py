@@ -0,0 +1,211 @@
+'''
+Metadata for the URLs of investment transactions
+
+Investments link to a reddit post, the investments view shows the post's score
+next to each one. The posts are fetched here rather than by every browser: all
+the URLs of a page are fetched at once from a thread pool, each URL only once
+however many investments share it, and the answers are cached for a while with
+the least recently used evicted first. A URL being fetched for one request is
+waited on by any other request that needs it rather than fetched again.
+Anyone can put any URL in an investment, so only http(s) URLs on reddit's hosts
+are fetched and redirects are only followed while they stay on them.
+'''
+import json
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from time import time
+from urllib.parse import urljoin, urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from metrics import Counter
+
+# Seconds metadata is kept, failures are retried sooner
+METADATA_TTL = 300
+FAILURE_TTL = 30
+# Most URLs cached at once
+CACHE_SIZE = 1024
+# Seconds allowed to connect and between bytes of the answer
+FETCH_TIMEOUT = (2, 5)
+# Seconds a whole page of URLs may take, whatever is missing by then is reported as pending
+FETCH_DEADLINE = 8
+MAX_WORKERS = 8
+# Largest answer read, in bytes
+MAX_DOCUMENT_SIZE = 4 * 1024 * 1024
+# Hosts investment posts are fetched from, with their subdomains
+ALLOWED_HOSTS = ('reddit.com',)
+MAX_REDIRECTS = 3
+
+ENRICHMENT_LOOKUPS = Counter('enrichment_lookups_total', 'Investment URL metadata lookups', labels=('result',))
+
+
+def metadata_url(url):
+    # Reddit serves any post as JSON under /.json
+    return url.rstrip('/') + '/.json'
+
+
+def allowed_url(url, hosts=ALLOWED_HOSTS):
+    # Whether url is an http(s) URL on one of hosts or a subdomain of one
+    try:
+        parsed = urlparse(url)
+        host = (parsed.hostname or '').lower()
+    except ValueError:
+        return False
+    return parsed.scheme in ('http', 'https') and any(host == allowed or host.endswith('.' + allowed) for allowed in hosts)
+
+
+def find_first(document, key):
+    # Depth first search for the first value of key in a decoded JSON document
+    stack = [document]
+    while stack:
+        value = stack.pop()
+        if isinstance(value, dict):
+            if key in value:
+                return value[key]
+            stack.extend(reversed(list(value.values())))
+        elif isinstance(value, list):
+            stack.extend(reversed(value))
+    return None
+
+
+def parse_metadata(document):
+    return {'title': find_first(document, 'title'), 'ups': find_first(document, 'ups')}
+
+
+class MetadataCache(object):
+    # url -> (expiry time, metadata), least recently used first
+    def __init__(self, max_size=CACHE_SIZE):
+        self.max_size = max_size
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, url):
+        with self.lock:
+            entry = self.entries.get(url)
+            if entry is None:
+                return None
+            if entry[0] <= time():
+                del self.entries[url]
+                return None
+            self.entries.move_to_end(url)
+            return entry[1]
+
+    def put(self, url, metadata, ttl):
+        with self.lock:
+            self.entries[url] = (time() + ttl, metadata)
+            self.entries.move_to_end(url)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+
+class Enricher(object):
+    """
+    Fetches and caches the metadata of investment URLs
+    - metadata(urls) maps every url to {'title', 'ups'}, or to {'error'} if it could not be fetched
+    - enrich(transactions) adds that metadata to each transaction with a url
+    """
+
+    def __init__(self, ttl=METADATA_TTL, failure_ttl=FAILURE_TTL, cache_size=CACHE_SIZE, timeout=FETCH_TIMEOUT,
+                 deadline=FETCH_DEADLINE, max_workers=MAX_WORKERS, allowed_hosts=ALLOWED_HOSTS):
+        self.allowed_hosts = allowed_hosts
+        self.ttl = ttl
+        self.failure_ttl = failure_ttl
+        self.timeout = timeout
+        self.deadline = deadline
+        self.cache = MetadataCache(cache_size)
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='enrichment')
+
+        # url -> Future of the fetch in progress
+        self.fetching = {}
+        self.lock = threading.Lock()
+
+        self.session = requests.Session()
+        # Reddit turns away the default requests user agent
+        self.session.headers['User-Agent'] = 'blockchain-investments/1.0'
+        adapter = HTTPAdapter(pool_connections=max_workers, pool_maxsize=max_workers)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    def allowed(self, url):
+        return allowed_url(url, self.allowed_hosts)
+
+    def fetch(self, url):
+        # Metadata of one url, returns (metadata, ttl)
+        if not self.allowed(url):
+            return {'error': 'Not a reddit URL'}, self.ttl
+        try:
+            location = metadata_url(url)
+            for _ in range(MAX_REDIRECTS + 1):
+                with self.session.get(location, timeout=self.timeout, stream=True, allow_redirects=False) as response:
+                    if response.is_redirect:
+                        location = urljoin(location, response.headers['Location'])
+                        if not self.allowed(location):
+                            return {'error': 'Redirected away from reddit'}, self.ttl
+                        continue
+                    response.raise_for_status()
+                    body = response.raw.read(MAX_DOCUMENT_SIZE + 1, decode_content=True)
+                    break
+            else:
+                return {'error': 'Too many redirects'}, self.failure_ttl
+            if len(body) > MAX_DOCUMENT_SIZE:
+                return {'error': 'Response too large'}, self.ttl
+            return parse_metadata(json.loads(body)), self.ttl
+        except (requests.RequestException, ValueError) as e:
+            return {'error': str(e) or type(e).__name__}, self.failure_ttl
+
+    def run(self, url, future):
+        try:
+            metadata, ttl = self.fetch(url)
+            self.cache.put(url, metadata, ttl)
+            future.set_result(metadata)
+        except Exception as e:
+            future.set_exception(e)
+        finally:
+            with self.lock:
+                self.fetching.pop(url, None)
+
+    def start(self, url):
+        # The fetch of url in progress, starting it if nobody has
+        with self.lock:
+            future = self.fetching.get(url)
+            if future is None:
+                # Cached while we waited for the lock
+                metadata = self.cache.get(url)
+                if metadata is not None:
+                    future = Future()
+                    future.set_result(metadata)
+                    return future
+                future = self.fetching[url] = Future()
+                self.executor.submit(self.run, url, future)
+            return future
+
+    def metadata(self, urls):
+        results = {}
+        futures = {}
+        for url in set(urls):
+            metadata = self.cache.get(url)
+            if metadata is not None:
+                results[url] = metadata
+            else:
+                futures[url] = self.start(url)
+        ENRICHMENT_LOOKUPS.inc(len(results), result='hit')
+        ENRICHMENT_LOOKUPS.inc(len(futures), result='miss')
+
+        wait(futures.values(), timeout=self.deadline)
+        for url, future in futures.items():
+            if future.done() and future.exception() is None:
+                results[url] = future.result()
+            else:
+                # Still fetching, the next request will find it cached
+                results[url] = {'error': 'Pending'}
+        return results
+
+    def enrich(self, transactions):
+        metadata = self.metadata(transaction['url'] for transaction in transactions if transaction.get('url'))
+        return [dict(transaction, metadata=metadata[transaction['url']]) if transaction.get('url') else
+                dict(transaction) for transaction in transactions]
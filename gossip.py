@@ -0,0 +1,199 @@
+'''
+Push-based gossip of new blocks and transactions
+
+When a node seals a block or accepts a transaction it announces just the hash to
+its neighbours. A neighbour that has not seen the hash fetches the block or
+transaction from whoever announced it, checks it and announces it onwards, so
+news spreads through the network without anyone polling whole chains. Hashes
+are remembered for a while so every node handles each announcement once.
+Announcements are only taken from our registered neighbours, and only for
+well-formed hashes, so nobody else can make us fetch from a host of their choice.
+'''
+import re
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from time import time
+
+import requests
+
+from block import Block
+from mempool import transaction_hash
+
+# Seconds a hash is remembered after it was first seen
+SEEN_TTL = 600
+# Most hashes remembered at once, the oldest are forgotten first
+SEEN_SIZE = 100000
+# Announced blocks and transactions fetched at once, apart from the peer client's
+# pool since fetching a block can start a consensus round that waits on that pool
+FETCH_WORKERS = 8
+
+# Block and transaction hashes are hex sha256 digests
+HASH_PATTERN = re.compile('[0-9a-f]{64}')
+
+
+def valid_hash(value):
+    return isinstance(value, str) and HASH_PATTERN.fullmatch(value) is not None
+
+
+class SeenSet(object):
+    # Hashes seen recently, each forgotten SEEN_TTL seconds after it was added
+    def __init__(self, ttl=SEEN_TTL, max_size=SEEN_SIZE):
+        self.ttl = ttl
+        self.max_size = max_size
+        self.lock = threading.Lock()
+        # hash -> time first seen, oldest first
+        self.entries = OrderedDict()
+
+    def __contains__(self, key):
+        with self.lock:
+            self.expire()
+            return key in self.entries
+
+    def __len__(self):
+        return len(self.entries)
+
+    def add(self, key):
+        # Remember key, returns False if it was already seen
+        with self.lock:
+            self.expire()
+            if key in self.entries:
+                return False
+            self.entries[key] = time()
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+            return True
+
+    def discard(self, key):
+        with self.lock:
+            self.entries.pop(key, None)
+
+    def expire(self):
+        cutoff = time() - self.ttl
+        while self.entries:
+            key, seen = next(iter(self.entries.items()))
+            if seen > cutoff:
+                break
+            del self.entries[key]
+
+
+class Gossip(object):
+    """
+    Announces what the blockchain seals or accepts and handles the
+    announcements of other nodes
+    - address is how our neighbours reach us, peers fetch announced items from it,
+      nothing is announced until it is set
+    - on_chain_change is called when an announced block moved our tip
+    """
+
+    def __init__(self, blockchain, address=None, on_chain_change=None):
+        self.blockchain = blockchain
+        self.peers = blockchain.peers
+        self.address = address
+        self.on_chain_change = on_chain_change
+        self.seen = SeenSet()
+        self.executor = ThreadPoolExecutor(max_workers=FETCH_WORKERS, thread_name_prefix='gossip')
+        # Announcements sent and received, for the stats endpoint
+        self.sent = 0
+        self.received = 0
+
+        blockchain.on_block = self.announce_block
+        blockchain.on_transaction = self.announce_transaction
+
+    def announce(self, path, item_hash, exclude=None):
+        # Tell every neighbour but exclude about item_hash, without waiting for them
+        if self.address is None:
+            return
+        payload = {'hash': item_hash, 'origin': self.address}
+        for node in self.blockchain.nodes:
+            if node != exclude and node != self.address:
+                self.sent += 1
+                self.peers.executor.submit(self.send, node, path, payload)
+
+    def send(self, node, path, payload):
+        try:
+            self.peers.post(node, path, payload)
+        except (requests.RequestException, ValueError) as e:
+            self.blockchain.logger.debug('announcing to %s failed: %s', node, e)
+
+    def announce_block(self, block, exclude=None):
+        block_hash = self.blockchain.hash(block)
+        self.seen.add(block_hash)
+        self.announce('/gossip/block', block_hash, exclude)
+
+    def announce_transaction(self, transaction, exclude=None):
+        tx_hash = transaction_hash(transaction)
+        self.seen.add(tx_hash)
+        self.announce('/gossip/transaction', tx_hash, exclude)
+
+    def accepts(self, item_hash, origin):
+        # Whether an announcement is one we act on: a hash from one of our neighbours
+        return valid_hash(item_hash) and origin in self.blockchain.nodes
+
+    def receive_block(self, block_hash, origin):
+        """
+        Handle a block announcement that was accepted, returns False if the block
+        is known already otherwise fetches it from origin in the background and returns True
+        """
+        self.received += 1
+        if not self.seen.add(block_hash):
+            return False
+        if self.blockchain.knows_block(block_hash):
+            return False
+        self.executor.submit(self.fetch_block, block_hash, origin)
+        return True
+
+    def receive_transaction(self, tx_hash, origin):
+        # Same as receive_block for a pending transaction
+        self.received += 1
+        if not self.seen.add(tx_hash):
+            return False
+        if tx_hash in self.blockchain.mempool:
+            return False
+        self.executor.submit(self.fetch_transaction, tx_hash, origin)
+        return True
+
+    def fetch_block(self, block_hash, origin):
+        try:
+            block = Block(self.peers.get(origin, f'/blocks/{block_hash}'))
+        except (requests.RequestException, ValueError, TypeError, KeyError) as e:
+            # Let a later announcement of the same block try again
+            self.seen.discard(block_hash)
+            self.blockchain.logger.info('fetching block %s from %s failed: %s', block_hash, origin, e)
+            return
+        if block.block_hash != block_hash:
+            return
+
+        # A block whose parent we know is checked and added on its own, anything
+        # else means we are behind and have to catch up with origin
+        tip = self.blockchain.hash(self.blockchain.last_block)
+        if not self.blockchain.add_block(block) and not self.blockchain.resolve_conflicts(nodes=[origin]):
+            return
+
+        if self.on_chain_change is not None and self.blockchain.hash(self.blockchain.last_block) != tip:
+            self.on_chain_change()
+        self.announce('/gossip/block', block_hash, exclude=origin)
+
+    def fetch_transaction(self, tx_hash, origin):
+        try:
+            transaction = self.peers.get(origin, f'/mempool/{tx_hash}')
+        except (requests.RequestException, ValueError) as e:
+            # Most likely mined already, the block will get here on its own
+            self.blockchain.logger.debug('fetching transaction %s from %s failed: %s', tx_hash, origin, e)
+            return
+        if not isinstance(transaction, dict):
+            return
+        # Only the transaction that was announced, as fetch_block does for blocks
+        try:
+            if transaction_hash(transaction) != tx_hash:
+                return
+        except (TypeError, ValueError):
+            return
+
+        # Accepting it announces it onwards through blockchain.on_transaction
+        self.blockchain.submit_transaction(transaction.get('sender_address'), transaction.get('recipient_address'),
+                                           transaction.get('value'), transaction.get('signature'),
+                                           url=transaction.get('url'))
+
+    def stats(self):
+        return {'seen': len(self.seen), 'sent': self.sent, 'received': self.received}
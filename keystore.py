@@ -0,0 +1,141 @@
+'''
+Node identity and ready made wallet keys
+
+A node signs its checkpoints and collects its mining rewards with one key that
+has to survive restarts. It is kept in a PEM file next to the block store,
+generated the first time the node needs it and only read from then on.
+Generating a P-256 key takes a few milliseconds of CPU, so /wallet/new hands out
+key pairs a background thread generated ahead of time instead.
+'''
+import binascii
+import os
+import threading
+from collections import deque
+
+from Cryptodome.PublicKey import ECC
+
+from metrics import Counter
+
+CURVE = 'P-256'
+# Wallet key pairs kept ready, the pool is topped up once it is half empty
+KEY_POOL_SIZE = 64
+
+WALLET_POOL_MISSES = Counter('wallet_key_pool_misses_total', 'Wallets whose keys were generated on request')
+
+
+def export_private_key(private_key):
+    return binascii.hexlify(private_key.export_key(format='DER')).decode('ascii')
+
+
+def export_public_key(public_key):
+    return binascii.hexlify(public_key.export_key(format='DER')).decode('ascii')
+
+
+def key_path(store_path):
+    # Where the key of the node whose block store is at store_path lives, None for in-memory stores
+    if not store_path or store_path == ':memory:':
+        return None
+    return os.path.abspath(store_path) + '.key'
+
+
+def read_key(path):
+    with open(path) as key_file:
+        return ECC.import_key(key_file.read())
+
+
+def write_key(path, private_key):
+    # Write a new key file readable by us only, unless another process already wrote one
+    temporary = f'{path}.{os.getpid()}.tmp'
+    descriptor = os.open(temporary, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(descriptor, 'w') as key_file:
+        key_file.write(private_key.export_key(format='PEM'))
+    try:
+        # Appears complete or not at all, and never replaces a key already there
+        os.link(temporary, path)
+    finally:
+        os.unlink(temporary)
+
+
+class NodeKey(object):
+    """
+    The node's private key, loaded from path on first use and generated
+    and saved there if there is none yet
+    - with no path the key lives in memory only and changes on every start
+    """
+
+    def __init__(self, path=None):
+        self.path = path
+        self.lock = threading.Lock()
+        self._private_key = None
+        self._node_id = None
+
+    @property
+    def private_key(self):
+        with self.lock:
+            if self._private_key is None:
+                self._private_key = self.load()
+            return self._private_key
+
+    @property
+    def node_id(self):
+        # Our public key in hex, the address our mining rewards go to
+        if self._node_id is None:
+            self._node_id = export_public_key(self.private_key.public_key())
+        return self._node_id
+
+    def load(self):
+        if self.path is None:
+            return ECC.generate(curve=CURVE)
+        try:
+            return read_key(self.path)
+        except FileNotFoundError:
+            pass
+
+        private_key = ECC.generate(curve=CURVE)
+        try:
+            write_key(self.path, private_key)
+        except FileExistsError:
+            # Another process of this node got there first, its key is the one we keep
+            return read_key(self.path)
+        return private_key
+
+
+class KeyPool(object):
+    """
+    Wallet key pairs generated ahead of time by a background thread
+    - take() pops a ready pair, or generates one there and then if the pool ran dry
+    - pairs are exported as hex DER once and handed out once
+    """
+
+    def __init__(self, size=KEY_POOL_SIZE):
+        self.size = size
+        # (private key, public key) in hex, appended by the filler and popped by take
+        self.keys = deque()
+        self.wanted = threading.Event()
+        self.wanted.set()
+        self.thread = threading.Thread(target=self.fill, name='key-pool', daemon=True)
+        self.thread.start()
+
+    def __len__(self):
+        return len(self.keys)
+
+    @staticmethod
+    def generate():
+        private_key = ECC.generate(curve=CURVE)
+        return export_private_key(private_key), export_public_key(private_key.public_key())
+
+    def fill(self):
+        while True:
+            self.wanted.wait()
+            self.wanted.clear()
+            while len(self.keys) < self.size:
+                self.keys.append(self.generate())
+
+    def take(self):
+        if len(self.keys) <= self.size // 2:
+            self.wanted.set()
+        try:
+            return self.keys.popleft()
+        except IndexError:
+            WALLET_POOL_MISSES.inc()
+            return self.generate()
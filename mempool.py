@@ -0,0 +1,148 @@
+'''
+Pool of pending transactions waiting to be mined
+
+Transactions are deduplicated by the hash of their signed contents and the pool
+is capped both in count and in bytes. When it is full the lowest priority
+transaction is evicted: the smallest value when ordering by value, the newest
+when ordering by arrival. Blocks are mined over a bounded batch of the highest
+priority transactions, which leave the pool once the block is sealed.
+'''
+import heapq
+import json
+import threading
+from collections import OrderedDict
+from itertools import count
+
+from accounts import transaction_value
+from merkle import transaction_leaf
+from transaction import json_default
+
+MAX_COUNT = 10000
+MAX_BYTES = 8 * 1024 * 1024
+
+ORDER_BY_VALUE = 'value'
+ORDER_BY_ARRIVAL = 'arrival'
+
+
+def transaction_hash(transaction):
+    # Same digest as the transaction's merkle leaf
+    return transaction_leaf(transaction).hex()
+
+
+class Mempool(object):
+    def __init__(self, max_count=MAX_COUNT, max_bytes=MAX_BYTES, order=ORDER_BY_VALUE):
+        self.max_count = max_count
+        self.max_bytes = max_bytes
+        self.order = order
+        self.lock = threading.Lock()
+
+        # tx hash -> (priority, transaction, size), in arrival order
+        self.pending = OrderedDict()
+        # Min-heap of (priority, tx hash) used to find what to evict, stale entries are skipped
+        self.heap = []
+        self.arrivals = count()
+        self.bytes = 0
+        self.evictions = 0
+        self.duplicates = 0
+
+    def __len__(self):
+        return len(self.pending)
+
+    def __contains__(self, tx_hash):
+        return tx_hash in self.pending
+
+    def get(self, tx_hash):
+        # The pending transaction with this hash or None
+        with self.lock:
+            entry = self.pending.get(tx_hash)
+        return entry[1] if entry else None
+
+    def priority(self, transaction):
+        if self.order == ORDER_BY_VALUE:
+            return (transaction_value(transaction), -next(self.arrivals))
+        return (-next(self.arrivals),)
+
+    def add(self, transaction):
+        """
+        Add a transaction to the pool, returns False if it was already
+        pending or was evicted straight away because the pool is full of
+        higher priority transactions
+        """
+        tx_hash = transaction_hash(transaction)
+        size = len(json.dumps(transaction, default=json_default))
+
+        with self.lock:
+            if tx_hash in self.pending:
+                self.duplicates += 1
+                return False
+
+            priority = self.priority(transaction)
+            self.pending[tx_hash] = (priority, transaction, size)
+            heapq.heappush(self.heap, (priority, tx_hash))
+            self.bytes += size
+
+            while len(self.pending) > self.max_count or self.bytes > self.max_bytes:
+                self.evict()
+
+            return tx_hash in self.pending
+
+    def evict(self):
+        # Drop the lowest priority transaction still pending
+        while self.heap:
+            priority, tx_hash = heapq.heappop(self.heap)
+            entry = self.pending.get(tx_hash)
+            if entry is not None and entry[0] == priority:
+                self.drop(tx_hash)
+                self.evictions += 1
+                return
+
+    def drop(self, tx_hash):
+        _, _, size = self.pending.pop(tx_hash)
+        self.bytes -= size
+        # The heap entry is left behind, rebuild once they outnumber the live ones
+        if len(self.heap) > 2 * len(self.pending) + 64:
+            self.compact()
+
+    def best(self, max_count):
+        # Up to max_count of the highest priority (tx hash, entry) pairs, the lock must be held
+        if self.order == ORDER_BY_VALUE:
+            return heapq.nlargest(max_count, self.pending.items(), key=lambda item: item[1][0])
+        return [item for item, _ in zip(self.pending.items(), range(max_count))]
+
+    def peek(self, max_count):
+        # Up to max_count of the highest priority transactions, left in the pool
+        with self.lock:
+            return [transaction for _, (_, transaction, _) in self.best(max_count)]
+
+    def take(self, max_count):
+        # Remove and return up to max_count of the highest priority transactions
+        with self.lock:
+            chosen = self.best(max_count)
+            for tx_hash, _ in chosen:
+                self.drop(tx_hash)
+            return [transaction for _, (_, transaction, _) in chosen]
+
+    def discard(self, transactions):
+        # Forget pending transactions that were confirmed in a block from elsewhere
+        with self.lock:
+            for transaction in transactions:
+                tx_hash = transaction_hash(transaction)
+                if tx_hash in self.pending:
+                    self.drop(tx_hash)
+
+    def compact(self):
+        # Rebuild the eviction heap without the entries of transactions no longer pending
+        self.heap = [(priority, tx_hash) for tx_hash, (priority, _, _) in self.pending.items()]
+        heapq.heapify(self.heap)
+
+    def stats(self):
+        with self.lock:
+            return {
+                'count': len(self.pending),
+                'bytes': self.bytes,
+                'max_count': self.max_count,
+                'max_bytes': self.max_bytes,
+                'evictions': self.evictions,
+                'duplicates': self.duplicates,
+                'order': self.order
+            }
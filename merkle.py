@@ -0,0 +1,66 @@
+'''
+Merkle trees over the transactions of a block
+
+Leaves are the sha256 of each transaction's canonical JSON, each level hashes
+pairs of the level below and an odd node out moves up to the next level as it
+is. Pairing it with itself instead would give [a, b, c] and [a, b, c, c] the
+same root, so a block's body could be swapped for one with a transaction
+repeated without changing its hash (the Bitcoin CVE-2012-2459 mutation). A block
+header only needs the root to commit to every transaction, and a single
+transaction can be shown to be in a block with one hash per level.
+'''
+import hashlib
+import json
+
+from transaction import SignedTransaction
+
+
+def transaction_leaf(transaction):
+    # Compact transactions hash their canonical JSON once and keep the digest
+    if isinstance(transaction, SignedTransaction):
+        return transaction.digest
+    return hashlib.sha256(json.dumps(transaction, sort_keys=True).encode()).digest()
+
+
+def _next_level(level):
+    pairs = [hashlib.sha256(level[i] + level[i + 1]).digest() for i in range(0, len(level) - 1, 2)]
+    if len(level) % 2:
+        pairs.append(level[-1])
+    return pairs
+
+
+def merkle_root(transactions):
+    # Hex root of the tree over transactions, the hash of nothing for an empty block
+    level = [transaction_leaf(transaction) for transaction in transactions]
+    if not level:
+        return hashlib.sha256(b'').hexdigest()
+
+    while len(level) > 1:
+        level = _next_level(level)
+    return level[0].hex()
+
+
+def merkle_proof(transactions, index):
+    """
+    Inclusion proof for transactions[index], a list of [sibling hash, side]
+    pairs from the leaf up where side says which side the sibling is on,
+    levels where the node has no sibling and moves up as it is are left out
+    """
+    level = [transaction_leaf(transaction) for transaction in transactions]
+    proof = []
+    while len(level) > 1:
+        sibling = index ^ 1
+        if sibling < len(level):
+            proof.append([level[sibling].hex(), 'left' if sibling < index else 'right'])
+        level = _next_level(level)
+        index //= 2
+    return proof
+
+
+def verify_merkle_proof(transaction, proof, root):
+    # Check that transaction is in the tree with this hex root
+    node = transaction_leaf(transaction)
+    for sibling, side in proof:
+        sibling = bytes.fromhex(sibling)
+        node = hashlib.sha256(sibling + node if side == 'left' else node + sibling).digest()
+    return node.hex() == root
@@ -0,0 +1,242 @@
+'''
+Parallel proof of work miner
+
+The nonce space is split into fixed size chunks that are handed out round robin
+to a pool of worker processes. Worker i scans chunks i, i + workers, i + 2*workers...
+and the first worker to find a valid proof sets a shared event so every other
+worker stops at the end of its current chunk.
+'''
+import multiprocessing
+import os
+import queue
+import threading
+from collections import OrderedDict, namedtuple
+from time import time
+from uuid import uuid4
+
+from block import Block
+from metrics import Counter, Gauge, Histogram
+from proof import DEFAULT_DIFFICULTY, ProofChecker
+
+# Number of nonces a worker checks between looking at the stop event
+CHUNK_SIZE = 4096
+# Seconds between progress reports while worker processes are searching
+PROGRESS_INTERVAL = 0.25
+# How many finished jobs the mining service remembers
+JOB_HISTORY = 100
+
+MiningResult = namedtuple('MiningResult', ['proof', 'attempts', 'elapsed', 'hash_rate'])
+
+# Recorded once per proof found, never inside the search loop
+MINING_ATTEMPTS = Counter('pow_attempts_total', 'Proofs of work tried by searches that found one')
+MINING_HASH_RATE = Gauge('pow_hash_rate', 'Proofs of work tried per second by the last successful search')
+MINING_SECONDS = Histogram('pow_search_seconds', 'Time taken to find a proof of work',
+                           buckets=(0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300))
+
+
+def _search(worker_id, workers, chunk_size, prefix, difficulty, found, result, attempts):
+    # Scan this worker's share of the nonce space until someone finds a proof
+    checker = ProofChecker(prefix, difficulty)
+    start = worker_id * chunk_size
+    step = workers * chunk_size
+
+    while not found.is_set():
+        proof = checker.scan(start, start + chunk_size)
+
+        if proof is not None:
+            with attempts.get_lock():
+                attempts.value += proof - start + 1
+            with result.get_lock():
+                if not found.is_set():
+                    result.value = proof
+                    found.set()
+            break
+
+        with attempts.get_lock():
+            attempts.value += chunk_size
+        start += step
+
+
+class ParallelMiner(object):
+    def __init__(self, workers=None, chunk_size=CHUNK_SIZE):
+        self.workers = workers or os.cpu_count() or 1
+        self.chunk_size = chunk_size
+
+    def mine(self, prefix, difficulty=DEFAULT_DIFFICULTY, stop=None, progress=None):
+        """
+        Search for a proof p such that proof.valid_proof(prefix, p, difficulty) holds,
+        prefix being the Block.work_prefix of the block to mine,
+        returns a MiningResult with the proof and the hash rate achieved
+        - stop is an optional threading.Event, setting it abandons the search and mine returns None
+        - progress is an optional callable, called now and then with the attempts made so far
+        """
+        start_time = time()
+
+        if self.workers == 1:
+            # Not worth paying for a process when there is only one core
+            checker = ProofChecker(prefix, difficulty)
+            start = 0
+            proof = None
+            while proof is None:
+                if stop is not None and stop.is_set():
+                    return None
+                proof = checker.scan(start, start + self.chunk_size)
+                start += self.chunk_size
+                if progress is not None:
+                    progress(start if proof is None else proof + 1)
+            return self._result(proof, proof + 1, start_time)
+
+        found = multiprocessing.Event()
+        result = multiprocessing.Value('q', -1)
+        attempts = multiprocessing.Value('q', 0)
+
+        processes = [
+            multiprocessing.Process(
+                target=_search,
+                args=(worker_id, self.workers, self.chunk_size, prefix,
+                      difficulty, found, result, attempts),
+                daemon=True)
+            for worker_id in range(self.workers)
+        ]
+        for process in processes:
+            process.start()
+
+        while not found.wait(PROGRESS_INTERVAL):
+            if progress is not None:
+                progress(attempts.value)
+            if stop is not None and stop.is_set():
+                # Stop the workers as if one of them had found a proof
+                found.set()
+        for process in processes:
+            process.join()
+
+        if result.value < 0:
+            return None
+        if progress is not None:
+            progress(attempts.value)
+        return self._result(result.value, attempts.value, start_time)
+
+    @staticmethod
+    def _result(proof, attempts, start_time):
+        elapsed = time() - start_time
+        hash_rate = attempts / elapsed if elapsed > 0 else 0.0
+        MINING_ATTEMPTS.inc(attempts)
+        MINING_HASH_RATE.set(hash_rate)
+        MINING_SECONDS.observe(elapsed)
+        return MiningResult(proof, attempts, elapsed, hash_rate)
+
+
+class MiningJob(object):
+    def __init__(self):
+        self.id = uuid4().hex
+        self.status = 'queued'
+        self.attempts = 0
+        self.created = time()
+        self.started = None
+        self.finished = None
+        self.block = None
+        self.cancelled = False
+
+    def to_dict(self):
+        elapsed = ((self.finished or time()) - self.started) if self.started else 0.0
+        return {
+            'id': self.id,
+            'status': self.status,
+            'attempts': self.attempts,
+            'elapsed': elapsed,
+            'hash_rate': self.attempts / elapsed if elapsed > 0 else 0.0,
+            'block': self.block
+        }
+
+
+class MiningService(object):
+    """
+    Mines blocks on a background thread, one queued job at a time, so requests
+    never wait on the proof of work. Each job mines one block on top of whatever
+    the tip is when its proof is found, starting over if the tip moves first.
+    """
+
+    def __init__(self, blockchain, reward_address=None):
+        self.blockchain = blockchain
+        # By default our node's address, only looked up once a block is mined
+        self.reward_address = reward_address
+        self.jobs = OrderedDict()
+        self.queue = queue.Queue()
+        self.lock = threading.Lock()
+        # Set to abandon the search in progress
+        self.stop = threading.Event()
+        self.thread = None
+
+    def submit(self):
+        # Queue a new job and return it straight away
+        job = MiningJob()
+        with self.lock:
+            self.jobs[job.id] = job
+            while len(self.jobs) > JOB_HISTORY:
+                self.jobs.popitem(last=False)
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run, name='mining', daemon=True)
+                self.thread.start()
+        self.queue.put(job)
+        return job
+
+    def get(self, job_id):
+        with self.lock:
+            return self.jobs.get(job_id)
+
+    def cancel(self, job):
+        job.cancelled = True
+        if job.status == 'running':
+            self.stop.set()
+
+    def restart(self):
+        # The chain changed under us, search again from the new tip
+        self.stop.set()
+
+    def run(self):
+        while True:
+            job = self.queue.get()
+            if job.cancelled:
+                job.status = 'cancelled'
+                continue
+            try:
+                self.mine(job)
+            except Exception:
+                self.blockchain.logger.exception('mining job %s failed', job.id)
+                job.status = 'failed'
+                job.finished = time()
+
+    def mine(self, job):
+        job.status = 'running'
+        job.started = time()
+        base = 0
+
+        def progress(attempts):
+            job.attempts = base + attempts
+
+        while True:
+            self.stop.clear()
+            if job.cancelled:
+                break
+
+            # The proof commits to the whole header, transactions included
+            template = self.blockchain.block_template(reward_address=self.reward_address or self.blockchain.node_id)
+            result = self.blockchain.miner.mine(Block.work_prefix(template), template['difficulty'],
+                                                stop=self.stop, progress=progress)
+            base = job.attempts
+            if result is None:
+                continue
+
+            # Only seal the block if nobody replaced the tip while we were searching
+            with self.blockchain.lock:
+                if self.blockchain.hash(self.blockchain.last_block) != template['previous_hash']:
+                    continue
+                block = self.blockchain.new_block(result.proof, template=template)
+
+            job.block = block
+            job.status = 'done'
+            job.finished = time()
+            return
+
+        job.status = 'cancelled'
+        job.finished = time()
@@ -0,0 +1,156 @@
+'''
+Concurrent access to the other nodes in the network
+
+Peers are polled from a thread pool over one pooled keep-alive session, every
+request has its own timeout and a whole round has a deadline, so one slow or dead
+peer costs at most the deadline instead of stalling the round.
+Long lists such as chains can be streamed, their items are decoded as they arrive.
+Requests can be given a time they have to be done by, a peer still sending
+then has its connection shut down however slowly it trickles bytes.
+'''
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait
+from contextlib import contextmanager
+from time import perf_counter
+
+import requests
+from requests.adapters import HTTPAdapter
+
+import wire
+from metrics import Counter, Histogram
+
+# Seconds allowed to connect to a peer and between bytes of its response
+PEER_TIMEOUT = (2, 5)
+# Seconds allowed for a whole round of requests to every peer
+ROUND_DEADLINE = 10
+# Seconds allowed for a whole consensus round, downloading headers and blocks included
+SYNC_DEADLINE = 120
+MAX_WORKERS = 16
+# Bytes read from a streamed response at a time
+STREAM_CHUNK_SIZE = 64 * 1024
+
+PEER_SECONDS = Histogram('peer_request_seconds', 'Time taken by requests to other nodes', labels=('peer',))
+PEER_FAILURES = Counter('peer_failures_total', 'Requests to other nodes that failed', labels=('peer', 'reason'))
+
+
+class ResponseBody(object):
+    # File-like view of a streamed response, errors while reading come out as requests exceptions
+    def __init__(self, response, chunk_size=STREAM_CHUNK_SIZE):
+        self.chunks = response.iter_content(chunk_size)
+        self.buffer = b''
+
+    def read(self, size=-1):
+        if not self.buffer:
+            self.buffer = next(self.chunks, b'')
+        if size < 0:
+            size = len(self.buffer)
+        data, self.buffer = self.buffer[:size], self.buffer[size:]
+        return data
+
+
+class PeerClient(object):
+    def __init__(self, timeout=PEER_TIMEOUT, deadline=ROUND_DEADLINE, max_workers=MAX_WORKERS,
+                 sync_deadline=SYNC_DEADLINE):
+        self.timeout = timeout
+        self.deadline = deadline
+        self.sync_deadline = sync_deadline
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='peer')
+
+        # Keep connections to every peer alive between rounds
+        self.session = requests.Session()
+        if wire.msgpack is not None:
+            # Peers that can't speak msgpack fall back to JSON
+            self.session.headers['Accept'] = f'{wire.MSGPACK_MIMETYPE}, {wire.JSON_MIMETYPE};q=0.9'
+        adapter = HTTPAdapter(pool_connections=max_workers, pool_maxsize=max_workers)
+        self.session.mount('http://', adapter)
+
+    def get(self, node, path, until=None):
+        # GET path from node and decode the body in whichever format the peer answered in
+        return self.request(node, 'GET', path, until=until)
+
+    def request(self, node, method, path, payload=None, until=None):
+        start = perf_counter()
+        try:
+            with self.response(node, method, path, payload, until) as response:
+                return wire.decode(response.headers.get('Content-Type'), response.content)
+        except (requests.RequestException, ValueError) as e:
+            PEER_FAILURES.inc(peer=node, reason=type(e).__name__)
+            raise
+        finally:
+            PEER_SECONDS.observe(perf_counter() - start, peer=node)
+
+    def stream(self, node, path, key, until=None):
+        """
+        GET path from node and yield the items of the list under key as
+        they arrive, closing the generator early drops the rest of the body
+        """
+        start = perf_counter()
+        try:
+            with self.response(node, 'GET', path, until=until) as response:
+                yield from wire.iter_array(response.headers.get('Content-Type'), ResponseBody(response), key)
+        except (requests.RequestException, ValueError, KeyError) as e:
+            PEER_FAILURES.inc(peer=node, reason=type(e).__name__)
+            raise
+        finally:
+            PEER_SECONDS.observe(perf_counter() - start, peer=node)
+
+    @contextmanager
+    def response(self, node, method, path, payload=None, until=None):
+        """
+        Send a request to node and yield the successful response, its body is read as it is used
+        - until is a perf_counter() time the whole response has to be in by, after it the
+          connection is shut down and reading the body fails with requests.Timeout
+        """
+        timeout = self.timeout
+        if until is not None:
+            remaining = until - perf_counter()
+            if remaining <= 0:
+                raise requests.Timeout('deadline exceeded')
+            timeout = tuple(min(limit, remaining) for limit in timeout)
+
+        timer = None
+        try:
+            with self.session.request(method, f'http://{node}{path}', json=payload,
+                                      timeout=timeout, stream=True) as response:
+                response.raise_for_status()
+                if until is not None:
+                    # Socket timeouts only bound the wait for each read, this bounds the whole body
+                    timer = threading.Timer(max(until - perf_counter(), 0), response.raw.shutdown)
+                    timer.daemon = True
+                    timer.start()
+                yield response
+        except (requests.RequestException, ValueError, KeyError, OSError) as e:
+            if until is not None and perf_counter() >= until:
+                raise requests.Timeout('deadline exceeded') from e
+            raise
+        finally:
+            if timer is not None:
+                timer.cancel()
+
+    def post(self, node, path, payload):
+        # POST a JSON payload to node and decode the answer
+        return self.request(node, 'POST', path, payload)
+
+    def fetch_all(self, nodes, path):
+        """
+        GET path from every node at once, returns (results, failures)
+        where results maps node -> parsed body and failures maps node -> reason
+        """
+        futures = {self.executor.submit(self.get, node, path): node for node in nodes}
+        done, not_done = wait(futures, timeout=self.deadline)
+
+        results = {}
+        failures = {}
+        for future in done:
+            node = futures[future]
+            try:
+                results[node] = future.result()
+            except (requests.RequestException, ValueError) as e:
+                failures[node] = str(e) or type(e).__name__
+
+        for future in not_done:
+            future.cancel()
+            failures[futures[future]] = 'deadline exceeded'
+            PEER_FAILURES.inc(peer=futures[future], reason='deadline exceeded')
+
+        return results, failures
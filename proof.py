@@ -0,0 +1,57 @@
+'''
+Fast path for checking proofs of work
+
+The proof of work commits to the whole block header: a proof p is valid for a
+header when sha256(prefix + p), read as a 256 bit number, is at most
+MAX_TARGET // difficulty, where prefix is the canonical JSON of the header
+without its proof (see Block.work_prefix). The difficulty is the number of
+hashes a miner expects to try. Rather than formatting the whole hex digest we
+compare the raw digest against the target as bytes.
+'''
+import hashlib
+from functools import lru_cache
+
+MAX_TARGET = 2 ** 256 - 1
+# Same as asking for four leading hex zeroes
+DEFAULT_DIFFICULTY = 16 ** 4
+
+
+@lru_cache(maxsize=64)
+def difficulty_target(difficulty=DEFAULT_DIFFICULTY):
+    # Largest 32 byte digest that meets the difficulty
+    return (MAX_TARGET // max(int(difficulty), 1)).to_bytes(32, 'big')
+
+
+def valid_proof(prefix, proof, difficulty=DEFAULT_DIFFICULTY):
+    # Single check, prefix is the serialized header the proof is for
+    return hashlib.sha256(prefix + str(proof).encode()).digest() <= difficulty_target(difficulty)
+
+
+class ProofChecker(object):
+    """
+    Checks many candidate proofs for one header, the sha256 state for
+    the header prefix is built once and copied for every candidate
+    """
+
+    def __init__(self, prefix, difficulty=DEFAULT_DIFFICULTY):
+        self.prefix = hashlib.sha256(prefix)
+        self.target = difficulty_target(difficulty)
+
+    def check(self, proof):
+        h = self.prefix.copy()
+        h.update(str(proof).encode())
+        return h.digest() <= self.target
+
+    def scan(self, start, stop):
+        """
+        Check the integer proofs in range(start, stop),
+        returns the first valid one or None
+        """
+        copy = self.prefix.copy
+        target = self.target
+        for proof in range(start, stop):
+            h = copy()
+            h.update(b'%d' % proof)
+            if h.digest() <= target:
+                return proof
+        return None
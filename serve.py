@@ -0,0 +1,146 @@
+'''
+Production server for a node
+
+Runs the node as one writer process and a pool of reader processes. The writer
+is the only process that holds the mempool, mines and changes the chain, it
+listens on a local port. Readers share the public port, answer the read routes
+(/chain, /headers, /blocks, /balance, /nodes/get...) and the stateless signing
+routes from a read only connection to the writer's SQLite store, and forward
+everything else to the writer. Reads scale with the number of readers while
+every write goes through one process.
+
+gunicorn is used when it is installed (pip install gunicorn), otherwise every
+process is a threaded werkzeug server and the readers share one listening socket.
+Run: BLOCKCHAIN_DB=blockchain.db python serve.py --port 5000 --workers 4
+'''
+import argparse
+import os
+import signal
+import socket
+import subprocess
+import sys
+import time
+
+import requests
+
+try:
+    import gunicorn
+except ImportError:
+    gunicorn = None
+
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+THREADS = 8
+# Seconds the writer has to open the store and answer
+STARTUP_TIMEOUT = 60
+
+
+def listen(host, port):
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(128)
+    sock.set_inheritable(True)
+    return sock
+
+
+def spawn(args, role, sock, workers, env):
+    # Start workers processes of one role serving on sock, returns the processes
+    env = dict(os.environ, NODE_ROLE=role, **env)
+    host, port = sock.getsockname()[:2]
+
+    if args.server == 'gunicorn':
+        # gunicorn binds the port itself
+        sock.close()
+        command = [sys.executable, '-m', 'gunicorn', '--workers', str(workers), '--threads', str(args.threads),
+                   '--bind', f'{host}:{port}', '--chdir', APP_DIR, 'app:app']
+        return [subprocess.Popen(command, env=env)]
+
+    command = [sys.executable, os.path.abspath(__file__), 'worker', '--host', host, '--port', str(port),
+               '--fd', str(sock.fileno())]
+    return [subprocess.Popen(command, env=env, pass_fds=(sock.fileno(),)) for _ in range(workers)]
+
+
+def wait_for(url, processes):
+    deadline = time.time() + STARTUP_TIMEOUT
+    while time.time() < deadline:
+        if any(process.poll() is not None for process in processes):
+            raise RuntimeError('the writer exited while starting')
+        try:
+            if requests.get(url + '/chain/head', timeout=1).ok:
+                return
+        except requests.RequestException:
+            pass
+        time.sleep(0.1)
+    raise RuntimeError(f'the writer did not answer within {STARTUP_TIMEOUT}s')
+
+
+def worker(args):
+    # One threaded werkzeug server on the listening socket serve.py handed down
+    from werkzeug.serving import make_server
+
+    sys.path.insert(0, APP_DIR)
+    from app import app
+
+    server = make_server(args.host, args.port, app, threaded=True, fd=args.fd)
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    server.serve_forever()
+
+
+def serve(args):
+    # Readers and writer share the store by path, wherever they run from
+    env = {'BLOCKCHAIN_DB': os.path.abspath(os.environ.get('BLOCKCHAIN_DB', 'blockchain.db'))}
+    public = listen(args.host, args.port)
+
+    writer_sock = listen('127.0.0.1', args.writer_port)
+    writer_url = 'http://127.0.0.1:%d' % writer_sock.getsockname()[1]
+    processes = spawn(args, 'writer', writer_sock, 1, env)
+    if args.server != 'gunicorn':
+        writer_sock.close()
+
+    try:
+        wait_for(writer_url, processes)
+        processes += spawn(args, 'reader', public, args.workers, dict(env, WRITER_URL=writer_url))
+        if args.server != 'gunicorn':
+            public.close()
+        print(f'serving on {args.host}:{args.port} with {args.workers} readers '
+              f'and a writer on {writer_url} ({args.server})', flush=True)
+
+        signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+        # If any process dies take the rest down with it, a supervisor can restart the lot
+        while all(process.poll() is None for process in processes):
+            time.sleep(0.5)
+        sys.exit(1)
+    finally:
+        for process in processes:
+            if process.poll() is None:
+                process.terminate()
+        for process in processes:
+            process.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    subcommands = parser.add_subparsers(dest='command')
+
+    parser.add_argument('--host', default='0.0.0.0')
+    parser.add_argument('--port', type=int, default=5000)
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help='reader processes')
+    parser.add_argument('--threads', type=int, default=THREADS, help='threads per gunicorn worker')
+    parser.add_argument('--writer-port', type=int, default=0, help='local port of the writer, any free one by default')
+    parser.add_argument('--server', choices=('gunicorn', 'werkzeug'),
+                        default='gunicorn' if gunicorn is not None else 'werkzeug')
+
+    worker_parser = subcommands.add_parser('worker', help='used by serve.py itself')
+    worker_parser.add_argument('--host', required=True)
+    worker_parser.add_argument('--port', type=int, required=True)
+    worker_parser.add_argument('--fd', type=int, required=True)
+
+    args = parser.parse_args()
+    if args.command == 'worker':
+        worker(args)
+    else:
+        serve(args)
+
+
+if __name__ == '__main__':
+    main()
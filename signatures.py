@@ -0,0 +1,106 @@
+'''
+Transaction signature verification
+
+The ECDSA verification itself is most of the cost, parsing a DER public key
+and building a DSS verifier is only about a tenth of it. Verifiers are still
+cached per sender address to skip that part for repeat senders, but the real
+gain for large batches, such as every transaction in a block received from a
+peer, comes from spreading them across a process pool.
+'''
+import binascii
+import os
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+from time import perf_counter
+
+from Cryptodome.Hash import SHA256
+from Cryptodome.PublicKey import ECC
+from Cryptodome.Signature import DSS
+
+from metrics import Counter, Histogram
+
+# How many sender addresses to keep parsed verifiers for
+KEY_CACHE_SIZE = 4096
+# Batches smaller than this are not worth shipping to other processes
+PARALLEL_THRESHOLD = 256
+
+# The fields covered by a signature, in the order they were signed in
+SIGNED_FIELDS = ('sender_address', 'recipient_address', 'value', 'url')
+
+VERIFICATIONS = Counter('signature_verifications_total', 'Transaction signatures checked', labels=('result',))
+VERIFY_SECONDS = Histogram('signature_verify_seconds', 'Time taken to check one transaction signature',
+                           buckets=(0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05))
+BATCH_SECONDS = Histogram('signature_batch_seconds', 'Time taken by verify_many to check a batch')
+
+_pool = None
+
+
+def transaction_message(transaction):
+    # The text that was signed, as produced by Transaction.to_dict
+    return str(OrderedDict((field, transaction[field]) for field in SIGNED_FIELDS
+                           if field in transaction)).encode('utf8')
+
+
+@lru_cache(maxsize=KEY_CACHE_SIZE)
+def load_verifier(sender_address):
+    public_key = ECC.import_key(binascii.unhexlify(sender_address))
+    return DSS.new(public_key, 'fips-186-3')
+
+
+def verify(sender_address, signature, transaction):
+    """
+    Check that signature was made over transaction by the private key
+    belonging to sender_address, returns <bool>
+    """
+    start = perf_counter()
+    valid = _verify(sender_address, signature, transaction)
+    VERIFY_SECONDS.observe(perf_counter() - start)
+    VERIFICATIONS.inc(result='ok' if valid else 'failed')
+    return valid
+
+
+def _verify(sender_address, signature, transaction):
+    try:
+        verifier = load_verifier(sender_address)
+        verifier.verify(SHA256.new(transaction_message(transaction)), binascii.unhexlify(signature))
+        return True
+    except (ValueError, TypeError, IndexError, binascii.Error):
+        return False
+
+
+def _verify_chunk(items):
+    # Runs in the pool processes too, where metrics would be lost, so verify_many records them
+    return [_verify(*item) for item in items]
+
+
+def verify_many(items):
+    """
+    Verify a list of (sender_address, signature, transaction) tuples,
+    returns a list of <bool> in the same order
+    """
+    items = list(items)
+    start = perf_counter()
+    results = _verify_batch(items)
+    BATCH_SECONDS.observe(perf_counter() - start)
+
+    valid = sum(results)
+    VERIFICATIONS.inc(valid, result='ok')
+    VERIFICATIONS.inc(len(results) - valid, result='failed')
+    return results
+
+
+def _verify_batch(items):
+    global _pool
+
+    workers = os.cpu_count() or 1
+    if len(items) < PARALLEL_THRESHOLD or workers == 1:
+        return _verify_chunk(items)
+
+    if _pool is None:
+        _pool = ProcessPoolExecutor(max_workers=workers)
+
+    # One contiguous chunk per process, each process keeps its own key cache
+    chunk_size = -(-len(items) // workers)
+    chunks = [items[i:i + chunk_size] for i in range(0, len(items), chunk_size)]
+    return [result for chunk in _pool.map(_verify_chunk, chunks) for result in chunk]
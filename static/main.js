@@ -9,6 +9,15 @@ angular.module('BlockchainApp').factory('blockchainFactory', function ($http) {
         getChain: function () {
             return $http.get('/chain')
         },
+        getChainHead: function () {
+            return $http.get('/chain/head')
+        },
+        getChainSince: function (hash, limit) {
+            return $http.get('/chain', { params: { 'since_hash': hash, 'limit': limit } })
+        },
+        getChainPage: function (start, limit) {
+            return $http.get('/chain', { params: { 'start': start, 'limit': limit } })
+        },
         getNodes: function () {
             return $http.get('/nodes/get')
         },
@@ -16,7 +25,7 @@ angular.module('BlockchainApp').factory('blockchainFactory', function ($http) {
             return $http.get('/wallet/new')
         },
         mine: function () {
-            return $http.get('/mine')
+            return $http.post('/mine')
         },
         registerNode: function (nodes) {
             return $http.post('/nodes/register', { 'nodes': [node] })
@@ -36,57 +45,76 @@ angular.module('BlockchainApp').factory('blockchainFactory', function ($http) {
         submitInvestment: function (sender, recipient, amount, signature, url) {
             return $http.post('/investments/new', { 'sender_address': sender, 'signature': signature, 'recipient_address': recipient, 'amount': amount, 'url': url })
         },
-        getRedditJSON: function (url) {
-            return $http.get(url)
+        getBalance: function (address) {
+            return $http.get('/balance/' + encodeURIComponent(address))
+        },
+        getInvestments: function () {
+            return $http.get('/investments')
         }
     }
     return methods;
 })
-function findWalletBalance(address, transactions) {
-    var current_balance = 0
-    for (let i = 0; i < transactions.length; i++) {
-        if (transactions[i].recipient_address == address) {
-            current_balance += transactions[i].value
-        }
-        if (transactions[i].sender_address == address) {
-            current_balance -= transactions[i].value
-        }
-    }
-    return current_balance
-}
-
 function myAlertTop() {
     $(".myAlert-top").show();
     setTimeout(function () {
         $(".myAlert-top").hide();
     }, 2000);
 }
-var isFirstUpsFound = false
-function traverse(jsonObj) {
-    if (jsonObj !== null && typeof jsonObj == "object") {
-        Object.entries(jsonObj).forEach(([key, value]) => {
-            // key is either an array index or object key
-            if (key !== 'ups' && !isFirstUpsFound) {
-                traverse(value);
-            }
-            else if (!isFirstUpsFound) {
-                console.log(value)
-                isFirstUpsFound = true
-            }
-        });
-    }
-    else {
-
-    }
-}
-
-angular.module('BlockchainApp').controller('mainController', function (blockchainFactory, $http, $scope) {
+angular.module('BlockchainApp').controller('mainController', function (blockchainFactory, $http, $q, $scope) {
     $scope.chain = []
     $scope.table_content = 'blockchain'
-    blockchainFactory.getChain()
-        .then(function (res) {
-            $scope.chain = res.data['chain']
-        })
+
+    // How many of the latest blocks the browser loads at first, and more at a time when asked for older ones
+    var CHAIN_PAGE = 100
+    // Position in the node's chain of the first block in $scope.chain
+    $scope.chainStart = 0
+    // Hash of the last block in $scope.chain, only blocks after it are downloaded
+    var chainTip = null
+    // The latest CHAIN_PAGE blocks of a chain of length blocks, instead of all of them
+    function getTail(length) {
+        var start = Math.max(length - CHAIN_PAGE, 0)
+        return blockchainFactory.getChainPage(start, length - start)
+            .then(function (res) {
+                $scope.chainStart = res.data['start']
+                $scope.chain = res.data['chain']
+            })
+    }
+    function refreshChain() {
+        return blockchainFactory.getChainHead()
+            .then(function (head) {
+                if (head.data['hash'] === chainTip) {
+                    return $scope.chain
+                }
+                var missing = head.data['length'] - ($scope.chainStart + $scope.chain.length)
+                // Only a few blocks behind, fetch the ones after chainTip in one page
+                var request = (chainTip === null || missing <= 0 || missing > CHAIN_PAGE)
+                    ? $q.reject()
+                    : blockchainFactory.getChainSince(chainTip, missing)
+                        .then(function (res) {
+                            return res.data['chain'].length === missing ? res.data['chain'] : $q.reject()
+                        })
+                return request
+                    .then(function (blocks) {
+                        $scope.chain = $scope.chain.concat(blocks)
+                    })
+                    .catch(function () {
+                        // Nothing loaded yet, far behind or our copy is not on the node's chain anymore
+                        return getTail(head.data['length'])
+                    })
+                    .then(function () {
+                        chainTip = head.data['hash']
+                        return $scope.chain
+                    })
+            })
+    }
+    $scope.loadOlder = function () {
+        var start = Math.max($scope.chainStart - CHAIN_PAGE, 0)
+        return blockchainFactory.getChainPage(start, $scope.chainStart - start)
+            .then(function (res) {
+                $scope.chain = res.data['chain'].concat($scope.chain)
+                $scope.chainStart = start
+            })
+    }
 
     $scope.createWallet = function () {
         let private_key_text = document.getElementById('private_key')
@@ -218,38 +246,26 @@ angular.module('BlockchainApp').controller('mainController', function (blockchai
             });
     }
     $scope.transactions = []
-    blockchainFactory.getChain()
-        .then(function (res) {
-            $scope.chain = res.data['chain']
-            var length = res.data['length']
-            var transactions = []
-            for (i = 1; i < length; i++) {
-                for (j = 0; j < $scope.chain[i]["transactions"].length; j++) {
-                    transactions.push($scope.chain[i]["transactions"][j]);
-                }
-            }
-            $scope.all_transactions = transactions
-        })
+    refreshChain()
     $scope.investments = []
 
     $scope.changeTableView = function (selection) {
         var dropdownEl = document.getElementById('dropdown-text');
         if (selection == 'blockchain') {
             dropdownEl.innerHTML = 'Browser'
-            blockchainFactory.getChain()
-                .then(function (res) {
-                    $scope.chain = res.data['chain']
+            refreshChain()
+                .then(function () {
                     $scope.table_content = 'blockchain'
                 })
         }
         else if (selection == 'transactions') {
             dropdownEl.innerHTML = 'Transactions'
-            blockchainFactory.getChain()
-                .then(function (res) {
-                    $scope.chain = res.data['chain']
-                    var length = res.data['length']
+            refreshChain()
+                .then(function () {
+                    var length = $scope.chain.length
                     var transactions = []
-                    for (i = 1; i < length; i++) {
+                    // The genesis block has no transactions, and may not be loaded at all
+                    for (i = 0; i < length; i++) {
                         for (j = 0; j < $scope.chain[i]["transactions"].length; j++) {
                             if (!$scope.chain[i]["transactions"][j]['url']) {
                                 transactions.push($scope.chain[i]["transactions"][j]);
@@ -262,28 +278,10 @@ angular.module('BlockchainApp').controller('mainController', function (blockchai
         }
         else if (selection == 'investments') {
             dropdownEl.innerHTML = 'Investments'
-            blockchainFactory.getChain()
-                .then(function (res) {
-                    $scope.chain = res.data['chain']
-                    var length = res.data['length']
-                    var investments = []
-                    for (i = 1; i < length; i++) {
-                        for (j = 0; j < $scope.chain[i]["transactions"].length; j++) {
-                            if ($scope.chain[i]["transactions"][j]['url']) {
-                                blockchainFactory.getRedditJSON(`${$scope.chain[i]["transactions"][j]['url']}/.json`)
-                                    .then(function (res) {
-                                        //that's all... no magic, no bloated framework
-                                        traverse(res);
-                                        isFirstUpsFound = false
-                                    })
-                                    .catch(function (err) {
-                                        console.log(err)
-                                    })
-                                investments.push($scope.chain[i]["transactions"][j]);
-                            }
-                        }
-                    }
-                    $scope.investments = investments
+            // Joined with their url's metadata by the node, which fetches and caches it
+            blockchainFactory.getInvestments()
+                .then(function (response) {
+                    $scope.investments = response.data['investments']
                     $scope.table_content = 'investments'
                 })
         }
@@ -320,6 +318,9 @@ angular.module('BlockchainApp').controller('mainController', function (blockchai
     var wallet_balance = document.getElementById('wallet_balance')
     $('#input_wallet_balance').on('input', function (e) {
         var wallet_address = document.getElementById('input_wallet_balance').value
-        wallet_balance.innerHTML = `${findWalletBalance(wallet_address, $scope.all_transactions)} RBC`
+        blockchainFactory.getBalance(wallet_address)
+            .then(function (res) {
+                wallet_balance.innerHTML = `${res.data['balance']} RBC`
+            })
     });
 })
\ No newline at end of file
@@ -1,13 +1,30 @@
 from collections import OrderedDict
+from collections.abc import Mapping
 
 import binascii
+import hashlib
+import json
 
 import Cryptodome
 from Cryptodome.Hash import SHA256
 from Cryptodome.PublicKey import ECC
 from Cryptodome.Signature import DSS
 
+# Every field a transaction can have, in the order it is built and signed in
+TRANSACTION_FIELDS = ('sender_address', 'recipient_address', 'value', 'url', 'signature')
+# Fields holding hex text, kept as raw bytes in memory
+_HEX_FIELDS = frozenset(('sender_address', 'recipient_address', 'signature'))
+
+
+def load_signer(sender_private_key):
+    # Private keys are never kept past the request that sent them, callers that
+    # sign many transactions with one key can pass the signer to sign_transaction
+    private_key = ECC.import_key(binascii.unhexlify(sender_private_key))
+    return DSS.new(private_key, 'fips-186-3')
+
+
 class Transaction:
+    __slots__ = ('sender_address', 'sender_private_key', 'recipient_address', 'value')
 
     def __init__(self, sender_address, sender_private_key, recipient_address, value):
         self.sender_address = sender_address
@@ -15,24 +32,21 @@ class Transaction:
         self.recipient_address = recipient_address
         self.value = value
 
-    def __getattr__(self, attr):
-        return self.data[attr]
-
     def to_dict(self):
         return OrderedDict({'sender_address': self.sender_address,
                             'recipient_address': self.recipient_address,
                             'value': self.value})
 
-    def sign_transaction(self):
+    def sign_transaction(self, signer=None):
         """
-        Sign transaction with private key
+        Sign transaction with private key, or with signer if it is already loaded
         """
-        private_key = ECC.import_key(binascii.unhexlify(self.sender_private_key))
-        signer = DSS.new(private_key, 'fips-186-3')
+        signer = signer or load_signer(self.sender_private_key)
         h = SHA256.new(str(self.to_dict()).encode('utf8'))
         return binascii.hexlify(signer.sign(h)).decode('ascii')
 
 class Investment(Transaction):
+    __slots__ = ('url',)
 
     def __init__(self, sender_address, sender_private_key, recipient_address, value, url):
         self.url = url
@@ -43,3 +57,91 @@ class Investment(Transaction):
                             'recipient_address': self.recipient_address,
                             'value': self.value,
                             'url':self.url})
+
+
+def _compact(value):
+    # Lowercase hex text as bytes, anything else as it is
+    if isinstance(value, str):
+        try:
+            raw = bytes.fromhex(value)
+        except ValueError:
+            return value
+        if raw.hex() == value:
+            return raw
+    return value
+
+
+class SignedTransaction(Mapping):
+    """
+    Read-only transaction as held in the mempool and in blocks, about half the
+    size of the dict it replaces. Keys and signatures are kept as raw bytes and
+    the digest of the canonical JSON is computed once and kept.
+    - reads like the dict: tx['value'], tx.get('url'), 'signature' in tx, dict(tx)
+    - to_dict() gives the plain dict back for JSON
+    """
+    __slots__ = TRANSACTION_FIELDS + ('_digest',)
+
+    def __init__(self, sender_address, recipient_address, value, url=None, signature=None):
+        self.sender_address = _compact(sender_address)
+        self.recipient_address = _compact(recipient_address)
+        self.value = value
+        self.url = url
+        self.signature = _compact(signature)
+        self._digest = None
+
+    @classmethod
+    def from_dict(cls, transaction):
+        """
+        Compact a transaction dict, dicts with fields we don't know about are
+        returned as they are so nothing a peer sent is dropped
+        """
+        if isinstance(transaction, cls) or not isinstance(transaction, dict):
+            return transaction
+        if 'sender_address' not in transaction or 'recipient_address' not in transaction or \
+                'value' not in transaction or not transaction.keys() <= set(TRANSACTION_FIELDS):
+            return transaction
+        if transaction.get('url', '') is None or transaction.get('signature', '') is None:
+            return transaction
+        return cls(**transaction)
+
+    def __getitem__(self, field):
+        if field not in TRANSACTION_FIELDS:
+            raise KeyError(field)
+        value = getattr(self, field)
+        if value is None and field in ('url', 'signature'):
+            raise KeyError(field)
+        if field in _HEX_FIELDS and value.__class__ is bytes:
+            return value.hex()
+        return value
+
+    def __iter__(self):
+        for field in TRANSACTION_FIELDS:
+            if field not in ('url', 'signature') or getattr(self, field) is not None:
+                yield field
+
+    def __len__(self):
+        return 3 + (self.url is not None) + (self.signature is not None)
+
+    def __repr__(self):
+        return f'SignedTransaction({self.to_dict()!r})'
+
+    def to_dict(self):
+        return OrderedDict((field, self[field]) for field in self)
+
+    @property
+    def digest(self):
+        # sha256 of the canonical JSON, the transaction's merkle leaf and mempool key
+        if self._digest is None:
+            self._digest = hashlib.sha256(json.dumps(self.to_dict(), sort_keys=True).encode()).digest()
+        return self._digest
+
+
+def json_default(obj):
+    # Lets json.dumps write compact transactions as the dicts they stand for
+    if isinstance(obj, SignedTransaction):
+        return obj.to_dict()
+    raise TypeError(f'Object of type {obj.__class__.__name__} is not JSON serializable')
+
+
+def compact_transactions(transactions):
+    return [SignedTransaction.from_dict(transaction) for transaction in transactions]
@@ -0,0 +1,202 @@
+'''
+Binary wire format for blocks and transactions
+
+When msgpack is installed, nodes and clients can ask for msgpack instead of JSON
+through the Accept and Content-Type headers. Keys, signatures and hashes are hex
+text in JSON, in msgpack they travel as raw bytes, which halves their size and
+skips parsing the hex. Without msgpack everything stays JSON.
+
+Chains are streamed a block at a time in both formats, and iter_array reads them
+back the same way so neither end ever holds a whole chain as one body.
+'''
+import codecs
+import json
+from collections.abc import Mapping
+
+from flask.json.provider import DefaultJSONProvider
+
+from transaction import SignedTransaction
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+JSON_MIMETYPE = 'application/json'
+MSGPACK_MIMETYPE = 'application/x-msgpack'
+
+# Characters of a streamed JSON body decoded at a time
+JSON_CHUNK_SIZE = 64 * 1024
+
+# Fields holding hex text that are sent as raw bytes
+HEX_FIELDS = frozenset(('sender_address', 'recipient_address', 'signature',
+                        'previous_hash', 'merkle_root', 'hash'))
+
+
+def _is_hex(value):
+    # Only lowercase hex survives the round trip through bytes unchanged
+    try:
+        return bytes.fromhex(value).hex() == value
+    except ValueError:
+        return False
+
+
+def to_wire(obj):
+    # Swap hex text for bytes in the fields that hold it
+    if isinstance(obj, Mapping):
+        return {key: bytes.fromhex(value) if key in HEX_FIELDS and isinstance(value, str) and _is_hex(value)
+                else to_wire(value)
+                for key, value in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return [to_wire(item) for item in obj]
+    return obj
+
+
+class JSONProvider(DefaultJSONProvider):
+    # Flask's JSON, able to write compact transactions as well
+    @staticmethod
+    def default(obj):
+        if isinstance(obj, SignedTransaction):
+            return obj.to_dict()
+        return DefaultJSONProvider.default(obj)
+
+
+def _hex_fields(obj):
+    # Called by msgpack for every map it decodes, turns bytes back into hex text
+    for key, value in obj.items():
+        if value.__class__ is bytes:
+            obj[key] = value.hex()
+    return obj
+
+
+def pack(obj):
+    return msgpack.packb(to_wire(obj), use_bin_type=True)
+
+
+def unpack(data):
+    return msgpack.unpackb(data, raw=False, strict_map_key=False, object_hook=_hex_fields)
+
+
+def wants_msgpack(accept_mimetypes):
+    # Whether a request's Accept header prefers msgpack over JSON
+    if msgpack is None:
+        return False
+    return accept_mimetypes.best_match([JSON_MIMETYPE, MSGPACK_MIMETYPE]) == MSGPACK_MIMETYPE
+
+
+def decode(content_type, data):
+    # Parse a request or response body by its Content-Type
+    if msgpack is not None and content_type and content_type.split(';')[0].strip() == MSGPACK_MIMETYPE:
+        return unpack(data)
+    return json.loads(data)
+
+
+def stream_msgpack(fields, key, items, count):
+    """
+    Yield a msgpack map made of fields plus key -> array of items, the items
+    are packed one at a time so the whole array never sits in memory
+    """
+    packer = msgpack.Packer(use_bin_type=True)
+    yield packer.pack_map_header(len(fields) + 1)
+    for name, value in fields.items():
+        yield packer.pack(name) + packer.pack(to_wire(value))
+    yield packer.pack(key) + packer.pack_array_header(count)
+    for item in items:
+        yield packer.pack(to_wire(item))
+
+
+class _JSONStream(object):
+    # Reads JSON values one at a time from a file-like object holding a bigger document
+    decoder = json.JSONDecoder()
+
+    def __init__(self, body):
+        self.body = body
+        self.text = codecs.getincrementaldecoder('utf-8')()
+        self.buffer = ''
+        self.position = 0
+        self.eof = False
+
+    def fill(self):
+        data = self.body.read(JSON_CHUNK_SIZE)
+        self.eof = not data
+        self.buffer = self.buffer[self.position:] + self.text.decode(data, final=self.eof)
+        self.position = 0
+
+    def peek(self):
+        # The next character that is not whitespace
+        while True:
+            while self.position < len(self.buffer) and self.buffer[self.position] in ' \t\r\n':
+                self.position += 1
+            if self.position < len(self.buffer):
+                return self.buffer[self.position]
+            if self.eof:
+                raise ValueError('Unexpected end of JSON')
+            self.fill()
+
+    def expect(self, character):
+        if self.peek() != character:
+            raise ValueError(f'Expected {character!r} at {self.buffer[self.position:self.position + 20]!r}')
+        self.position += 1
+
+    def value(self):
+        self.peek()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buffer, self.position)
+                # A number that ends the buffer may go on in the next chunk
+                if end < len(self.buffer) or self.eof:
+                    self.position = end
+                    return value
+            except json.JSONDecodeError:
+                if self.eof:
+                    raise
+            self.fill()
+
+
+def _iter_json_array(body, key):
+    stream = _JSONStream(body)
+    stream.expect('{')
+    if stream.peek() != '}':
+        while True:
+            name = stream.value()
+            stream.expect(':')
+            if name == key:
+                stream.expect('[')
+                if stream.peek() != ']':
+                    while True:
+                        yield stream.value()
+                        if stream.peek() == ']':
+                            break
+                        stream.expect(',')
+                return
+            stream.value()
+            if stream.peek() == '}':
+                break
+            stream.expect(',')
+    raise KeyError(key)
+
+
+def _iter_msgpack_array(body, key):
+    unpacker = msgpack.Unpacker(body, raw=False, strict_map_key=False, object_hook=_hex_fields)
+    try:
+        for _ in range(unpacker.read_map_header()):
+            if unpacker.unpack() == key:
+                for _ in range(unpacker.read_array_header()):
+                    yield unpacker.unpack()
+                return
+            unpacker.skip()
+    except msgpack.UnpackException as e:
+        raise ValueError(str(e) or type(e).__name__)
+    raise KeyError(key)
+
+
+def iter_array(content_type, body, key):
+    """
+    Yield the items of the array under key in a map, decoding them one at a
+    time as body (a file-like object) is read, in whichever format
+    content_type names. The rest of the map after the array is not read
+    - raises ValueError for a malformed body and KeyError if key is missing
+    """
+    if msgpack is not None and content_type and content_type.split(';')[0].strip() == MSGPACK_MIMETYPE:
+        return _iter_msgpack_array(body, key)
+    return _iter_json_array(body, key)